@@ -1,15 +1,33 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, g, has_app_context, has_request_context, Response, stream_with_context
 import sqlite3
 import os
 from datetime import datetime, timedelta
 import pandas as pd
 from openpyxl import load_workbook
 import io
+import json
+import csv
+import base64
+import hashlib
+import re
+import html
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import logging
-from collections import defaultdict
+import logging.handlers
+import gzip
+import shutil
+from collections import defaultdict, OrderedDict, Counter
 import time
+import queue
+import random
+import threading
+import atexit
+import uuid
+from concurrent.futures import Future
+from contextlib import closing
+from werkzeug.test import EnvironBuilder
+from werkzeug.exceptions import HTTPException
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -30,27 +48,771 @@ login_attempts = defaultdict(lambda: {'count': 0, 'lockout_until': 0})
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Configure security logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/security.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-security_logger = logging.getLogger('security')
-
 # Ensure logs folder exists
 os.makedirs('logs', exist_ok=True)
 
+# Security logging pipeline - request threads only enqueue records, a background
+# listener does the file/console I/O and a batching sink writes security_logs rows
+app.config['SECURITY_LOG_QUEUE_SIZE'] = 10000  # max pending records/rows before dropping
+app.config['SECURITY_LOG_BATCH_SIZE'] = 100  # rows per executemany
+app.config['SECURITY_LOG_FLUSH_MS'] = 250  # max time a row waits before being written
+app.config['SECURITY_LOG_INTERN_CACHE'] = 4096  # IP/user agent -> id lookups kept by the sink
+
+# Security log file rotation - rolled files are gzip-compressed, oldest beyond the count deleted
+app.config['SECURITY_LOG_FILE'] = 'logs/security.log'
+app.config['SECURITY_LOG_ROTATION'] = os.environ.get('FENIX_LOG_ROTATION', 'size')  # 'size' or 'time'
+app.config['SECURITY_LOG_MAX_BYTES'] = 10 * 1024 * 1024  # 'size' rotation: roll over at 10MB
+app.config['SECURITY_LOG_ROTATE_WHEN'] = 'midnight'  # 'time' rotation: TimedRotatingFileHandler interval
+app.config['SECURITY_LOG_BACKUP_COUNT'] = int(os.environ.get('FENIX_LOG_BACKUPS', 14))  # rolled files kept
+app.config['SECURITY_LOG_CONSOLE'] = os.environ.get('FENIX_LOG_CONSOLE', '1') != '0'  # echo to console
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a bounded queue - counts and drops records when it is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def gzip_log_namer(name):
+    """Name rolled log files with a .gz suffix"""
+    return name + '.gz'
+
+def gzip_log_rotator(source, dest):
+    """Compress a rolled log file (runs on the listener thread, not on requests)"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def create_log_file_handler():
+    """Size- or time-based rotating handler for the security log"""
+    if app.config['SECURITY_LOG_ROTATION'] == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(
+            app.config['SECURITY_LOG_FILE'],
+            when=app.config['SECURITY_LOG_ROTATE_WHEN'],
+            backupCount=app.config['SECURITY_LOG_BACKUP_COUNT'],
+            encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            app.config['SECURITY_LOG_FILE'],
+            maxBytes=app.config['SECURITY_LOG_MAX_BYTES'],
+            backupCount=app.config['SECURITY_LOG_BACKUP_COUNT'],
+            encoding='utf-8'
+        )
+    handler.namer = gzip_log_namer
+    handler.rotator = gzip_log_rotator
+    return handler
+
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [create_log_file_handler()]
+if app.config['SECURITY_LOG_CONSOLE']:
+    log_handlers.append(logging.StreamHandler())
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue_handler = DroppingQueueHandler(queue.Queue(maxsize=app.config['SECURITY_LOG_QUEUE_SIZE']))
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # final formatting is done by the listener
+log_listener = logging.handlers.QueueListener(
+    log_queue_handler.queue, *log_handlers, respect_handler_level=True
+)
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
+security_logger = logging.getLogger('security')
+
 DATABASE = 'school_inventory.db'
 
+# SQLite tuning - PRAGMAs applied once when a connection is opened
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',          # readers don't block the writer (and vice versa)
+    'synchronous': 'NORMAL',        # safe with WAL, avoids an fsync per commit
+    'cache_size': -16000,           # negative value = KiB (~16MB page cache)
+    'mmap_size': 64 * 1024 * 1024,  # 64MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,           # milliseconds to wait for a lock before SQLITE_BUSY
+}
+app.config['SQLITE_POOL_SIZE'] = 8  # idle reader connections kept for reuse
+app.config['SQLITE_BUSY_RETRIES'] = 5  # attempts for a write batch hitting SQLITE_BUSY
+app.config['SQLITE_BUSY_BACKOFF'] = 0.05  # initial backoff in seconds, doubled per retry
+app.config['DB_WRITER_MAX_BATCH'] = 64  # queued write jobs committed together
+
+# Old security logs are moved to per-month tables in a separate database attached as "archive"
+app.config['SECURITY_LOG_ARCHIVE_DATABASE'] = 'security_logs_archive.db'
+app.config['SECURITY_LOG_RETENTION_DAYS'] = 90  # logs older than this leave the hot table
+app.config['SECURITY_LOG_ARCHIVE_BATCH'] = 1000  # rows moved per write job
+app.config['MAINTENANCE_INTERVAL'] = 3600  # seconds between retention runs
+app.config['STOCK_SNAPSHOT_INTERVAL'] = 6 * 3600  # seconds between stock snapshots (bounds the replayed movements)
+app.config['STOCK_SNAPSHOT_DAILY_AFTER_DAYS'] = 30  # older snapshots are thinned to the last one per day
+app.config['STOCK_LEVEL_DAILY_DAYS'] = 90  # daily trend rows kept this long (weekly/monthly rows stay)
+app.config['STOCK_LEVEL_WEEKLY_DAYS'] = 730  # weekly trend rows kept this long (monthly rows stay)
+
+class PooledConnection(sqlite3.Connection):
+    """Connection handed out by the pool - close() releases it instead of closing"""
+
+    def close(self):
+        # Routes call close() when they are done; the pool owns the real
+        # connection and gets it back on app context teardown.
+        if self.in_transaction:
+            self.rollback()
+
+class ConnectionPool:
+    """Small pool of tuned, read-only SQLite connections shared between request threads"""
+
+    def __init__(self, database, pragmas, size, attachments=None):
+        self.database = database
+        self.pragmas = pragmas
+        self.attachments = attachments or {}
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self, factory=sqlite3.Connection, query_only=False):
+        """Open a new connection with the configured databases attached and PRAGMAs applied"""
+        conn = sqlite3.connect(self.database, factory=factory, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for alias, path in self.attachments.items():
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        if query_only:
+            conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def acquire(self):
+        """Get an idle reader connection or open a new one"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect(factory=PooledConnection, query_only=True)
+
+    def release(self, conn):
+        """Return a connection to the pool (closed if the pool is full)"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            sqlite3.Connection.close(conn)
+
+def is_busy_error(error):
+    """True if an OperationalError means SQLITE_BUSY / SQLITE_LOCKED"""
+    if getattr(error, 'sqlite_errorcode', None) is not None:
+        return error.sqlite_errorcode & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+class DatabaseWriter:
+    """Single writer thread - all mutations go through its one connection.
+
+    A job is a function taking the writer connection; it must not commit.
+    Jobs already queued when the writer wakes up are committed together in one
+    transaction (group commit), each inside a SAVEPOINT so a failing job only
+    undoes its own changes. Callers wait on a Future for the job's result.
+    """
+
+    def __init__(self, pool, max_batch, retries, backoff):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.commit_hooks = []  # called with the connection after each commit
+
+    def submit(self, job):
+        """Queue a write job and return a Future with its result"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job):
+        """Queue a write job and wait for its result (re-raises job errors)"""
+        return self.submit(job).result()
+
+    def stop(self):
+        """Finish queued jobs and stop the writer thread"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        conn = self.pool.connect()
+        conn.isolation_level = None  # transactions are managed explicitly below
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            if batch:
+                self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        delay = self.backoff
+        for attempt in range(self.retries):
+            results = []
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for job, future in batch:
+                    conn.execute('SAVEPOINT job')
+                    try:
+                        results.append((future, job(conn), None))
+                        conn.execute('RELEASE job')
+                    except sqlite3.OperationalError as e:
+                        if is_busy_error(e):
+                            raise
+                        conn.execute('ROLLBACK TO job')
+                        conn.execute('RELEASE job')
+                        results.append((future, None, e))
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO job')
+                        conn.execute('RELEASE job')
+                        results.append((future, None, e))
+                conn.execute('COMMIT')
+                self._run_commit_hooks(conn)
+                break
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if not is_busy_error(e) or attempt == self.retries - 1:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    return
+                security_logger.warning(f"Database busy, write batch retry {attempt + 1}/{self.retries - 1}")
+                time.sleep(delay * (1 + random.random()))
+                delay *= 2
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+        
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _run_commit_hooks(self, conn):
+        # Before the futures resolve, so callers see the effects of their own writes
+        for hook in self.commit_hooks:
+            try:
+                hook(conn)
+            except Exception as e:
+                security_logger.error(f"Commit hook {hook.__qualname__} failed: {e}")
+
+db_pool = ConnectionPool(DATABASE, app.config['SQLITE_PRAGMAS'], app.config['SQLITE_POOL_SIZE'],
+                         attachments={'archive': app.config['SECURITY_LOG_ARCHIVE_DATABASE']})
+db_writer = DatabaseWriter(db_pool, app.config['DB_WRITER_MAX_BATCH'],
+                           app.config['SQLITE_BUSY_RETRIES'], app.config['SQLITE_BUSY_BACKOFF'])
+atexit.register(db_writer.stop)
+
 def get_db_connection():
-    """Create database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get read-only database connection (one pooled connection per app context)"""
+    if not has_app_context():
+        # Scripts and background threads get their own connection and close it
+        return db_pool.connect()
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+def run_write(job, reason=None, source=None):
+    """Run job(conn) on the writer connection and return its result.
+
+    reason/source label the stock movements the job causes (see
+    migrate_add_stock_ledger); the actor is the logged-in user.
+    """
+    if reason is None:
+        return db_writer.run(job)
+    
+    actor = session.get('username') if has_request_context() else None
+    
+    def labelled(conn):
+        # Read by the stock movement triggers; the job's SAVEPOINT undoes it on failure
+        conn.execute('INSERT OR REPLACE INTO stock_movement_context (id, reason, source, actor) VALUES (1, ?, ?, ?)',
+                     (reason, source, actor))
+        result = job(conn)
+        conn.execute('DELETE FROM stock_movement_context')
+        return result
+    
+    return db_writer.run(labelled)
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Return the app context's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value or None if missing/expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def discard(self, predicate):
+        """Drop the entries whose key matches predicate(key)"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+app.config['DATA_VERSION_TTL'] = 5  # seconds before re-reading versions (catches other processes' writes)
+
+class DataVersions:
+    """Per-table data versions, mirrored in process.
+
+    Triggers bump data_versions on every change. The writer refreshes the
+    mirror after each commit, so conditional GETs can be answered without a
+    query; it is also re-read after DATA_VERSION_TTL seconds, for writes made
+    by other processes (maintenance scripts).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._versions = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.listeners = []  # called with the set of tables whose version changed
+
+    def refresh(self, conn):
+        rows = conn.execute('SELECT name, version FROM data_versions').fetchall()
+        with self._lock:
+            # Versions only grow - a reader whose snapshot predates a commit the
+            # writer already mirrored must not move them back, so merge with max
+            changed = {row['name'] for row in rows if row['version'] > self._versions.get(row['name'], -1)}
+            self._versions = {**self._versions, **{row['name']: row['version'] for row in rows if row['name'] in changed}}
+            self._loaded_at = time.monotonic()
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+
+    def get(self, tables):
+        """Current versions of tables, as a tuple"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            if has_app_context():
+                self.refresh(get_db_connection())  # released with the app context
+            else:
+                with closing(db_pool.connect(query_only=True)) as conn:
+                    self.refresh(conn)
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+data_versions = DataVersions(app.config['DATA_VERSION_TTL'])
+db_writer.commit_hooks.append(data_versions.refresh)
+
+# Lookup lists (categories, grades, publishers...) change a few times a term but
+# are read on every page load. Entries are dropped as soon as a commit changes
+# one of their tables, and the key also carries the versions they were read at.
+app.config['LOOKUP_CACHE_TTL'] = 300  # seconds
+lookup_cache = TTLCache(maxsize=64, ttl=app.config['LOOKUP_CACHE_TTL'])
+data_versions.listeners.append(
+    lambda changed: lookup_cache.discard(lambda key: not changed.isdisjoint(key[0]))
+)
+
+def cached_lookup(tables, name, loader):
+    """loader(conn) for the lookup called name, served from lookup_cache until
+    a write touches one of tables"""
+    key = (tables, name, data_versions.get(tables))
+    value = lookup_cache.get(key)
+    if value is None:
+        value = loader(get_db_connection())
+        lookup_cache.set(key, value)
+    return value
+
+def update_security_log_rollups(conn, rows):
+    """Add security_logs rows to the hourly and per-IP/per-user daily rollups.
+
+    rows are (event_type, username, ip_address, user_agent, success, details, created_at)
+    tuples, as written by the sink. Counts are aggregated in Python first so each
+    rollup row gets one upsert per batch.
+    """
+    hourly = Counter()
+    by_ip = defaultdict(lambda: [0, 0])
+    by_user = defaultdict(lambda: [0, 0])
+    for event_type, username, ip_address, _, success, _, created_at in rows:
+        hourly[(created_at[:13] + ':00', event_type, 1 if success else 0)] += 1
+        day = created_at[:10]
+        failed = 0 if success else 1
+        by_ip[(day, ip_address)][0] += 1
+        by_ip[(day, ip_address)][1] += failed
+        by_user[(day, username)][0] += 1
+        by_user[(day, username)][1] += failed
+    
+    conn.executemany('''
+        INSERT INTO security_log_hourly (hour, event_type, success, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (hour, event_type, success) DO UPDATE SET count = count + excluded.count
+    ''', [(*key, count) for key, count in hourly.items()])
+    conn.executemany('''
+        INSERT INTO security_log_daily_ip (day, ip_address, total, failed) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, ip_address) DO UPDATE SET
+            total = total + excluded.total, failed = failed + excluded.failed
+    ''', [(*key, *counts) for key, counts in by_ip.items()])
+    conn.executemany('''
+        INSERT INTO security_log_daily_user (day, username, total, failed) VALUES (?, ?, ?, ?)
+        ON CONFLICT (day, username) DO UPDATE SET
+            total = total + excluded.total, failed = failed + excluded.failed
+    ''', [(*key, *counts) for key, counts in by_user.items()])
+
+class SecurityLogSink:
+    """Batches security_logs rows and writes them with executemany via the writer.
+
+    add() never blocks: rows go into a bounded queue and are dropped (and
+    counted) when it is full. A background thread flushes every batch_size
+    rows or flush_ms milliseconds, whichever comes first.
+    """
+
+    INSERT_SQL = '''
+        INSERT INTO security_logs (event_type, username, ip_id, user_agent_id, success, details, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    def __init__(self, writer, queue_size, batch_size, flush_ms, intern_cache_size):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        # IPs and user agents are stored once in log_ips/log_user_agents; remember
+        # their ids so a batch from known clients needs no lookups
+        self._ids = TTLCache(maxsize=intern_cache_size, ttl=float('inf'))
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    def add(self, row):
+        """Queue a row for writing (dropped if the queue is full)"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            self.stats['queued'] += 1
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def pending(self):
+        """Number of rows waiting to be written"""
+        return self._queue.qsize()
+
+    def stop(self):
+        """Flush queued rows and stop the background thread"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='security-log-sink', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                self._flush(batch)
+
+    def _intern(self, conn, table, column, value, new_ids):
+        """Id of value in a lookup table, inserting it if needed (None stays None)"""
+        if value is None:
+            return None
+        key = (table, value)
+        value_id = self._ids.get(key) or new_ids.get(key)
+        if value_id is None:
+            conn.execute(f'INSERT OR IGNORE INTO {table} ({column}) VALUES (?)', (value,))
+            value_id = conn.execute(f'SELECT id FROM {table} WHERE {column} = ?', (value,)).fetchone()[0]
+            new_ids[key] = value_id
+        return value_id
+
+    def _write(self, conn, rows, new_ids):
+        stored = [
+            (event_type, username,
+             self._intern(conn, 'log_ips', 'ip_address', ip_address, new_ids),
+             self._intern(conn, 'log_user_agents', 'user_agent', user_agent, new_ids),
+             success, details, created_at)
+            for event_type, username, ip_address, user_agent, success, details, created_at in rows
+        ]
+        conn.executemany(self.INSERT_SQL, stored)
+        update_security_log_rollups(conn, rows)
+
+    def _flush(self, rows):
+        # Waiting here is what batches the next flush: rows keep queueing while we write
+        self.stats['batches'] += 1
+        new_ids = {}
+        
+        def job(conn):
+            new_ids.clear()  # the writer may rerun a batch that hit a busy database
+            self._write(conn, rows, new_ids)
+        
+        try:
+            self.writer.run(job)
+            # Only cache ids once they are committed - a rolled back batch may not keep them
+            for key, value_id in new_ids.items():
+                self._ids.set(key, value_id)
+            self.stats['written'] += len(rows)
+        except Exception as e:
+            self.stats['failed'] += len(rows)
+            security_logger.error(f"Failed to log to database: {e}")
+
+security_log_sink = SecurityLogSink(db_writer, app.config['SECURITY_LOG_QUEUE_SIZE'],
+                                    app.config['SECURITY_LOG_BATCH_SIZE'], app.config['SECURITY_LOG_FLUSH_MS'],
+                                    app.config['SECURITY_LOG_INTERN_CACHE'])
+atexit.register(security_log_sink.stop)  # runs before db_writer.stop (atexit is LIFO)
+
+# ==================== MAINTENANCE ====================
+
+class MaintenanceScheduler:
+    """Background thread running registered jobs (retention, rollups...) at fixed intervals"""
+
+    def __init__(self, startup_delay=60):
+        self.startup_delay = startup_delay
+        self.jobs = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def register(self, name, interval, func):
+        """Run func() every interval seconds"""
+        self.jobs.append({'name': name, 'interval': interval, 'func': func, 'next_run': 0})
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                first_run = time.monotonic() + self.startup_delay
+                for job in self.jobs:
+                    job['next_run'] = first_run
+                self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            for job in self.jobs:
+                if job['next_run'] <= time.monotonic():
+                    try:
+                        job['func']()
+                    except Exception as e:
+                        security_logger.error(f"Maintenance job {job['name']} failed: {e}")
+                    job['next_run'] = time.monotonic() + job['interval']
+            time.sleep(10)
+
+maintenance = MaintenanceScheduler()
+
+@app.before_request
+def start_maintenance():
+    """Start background maintenance with the first request (i.e. in the serving process)"""
+    maintenance.ensure_started()
+
+SECURITY_LOG_COLUMNS = 'id, event_type, username, ip_id, user_agent_id, success, details, created_at'
+
+def create_security_log_table(conn, table, autoincrement=False):
+    """Create a security log table (hot or archive) in the compact format -
+    IPs and user agents are ids into log_ips/log_user_agents"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY{' AUTOINCREMENT' if autoincrement else ''},
+            event_type TEXT NOT NULL,
+            username TEXT NOT NULL,
+            ip_id INTEGER NOT NULL,
+            user_agent_id INTEGER,
+            success INTEGER NOT NULL,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def security_log_archive_tables(conn):
+    """Names of the monthly archive tables, oldest first"""
+    rows = conn.execute('''
+        SELECT name FROM archive.sqlite_master
+        WHERE type = 'table' AND name GLOB 'security_logs_[0-9][0-9][0-9][0-9][0-9][0-9]'
+        ORDER BY name
+    ''').fetchall()
+    return [row['name'] for row in rows]
+
+def copy_security_log_batch(conn, cutoff, batch_size):
+    """Copy up to batch_size logs older than cutoff into their month's archive table.
+
+    Runs as a writer job that only writes to the archive database - SQLite
+    can't commit the archive and the main WAL database atomically, so the
+    delete from security_logs is a separate, later job. INSERT OR IGNORE makes
+    a batch copied before a crash (but not yet deleted) safe to copy again.
+    Returns {archive table: [copied ids]}.
+    """
+    rows = conn.execute(f'''
+        SELECT {SECURITY_LOG_COLUMNS} FROM security_logs
+        WHERE created_at < ? ORDER BY created_at, id LIMIT ?
+    ''', (cutoff, batch_size)).fetchall()
+    
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[row['created_at'][:7].replace('-', '')].append(tuple(row))
+    
+    copied = {}
+    for month, month_rows in by_month.items():
+        table = f'security_logs_{month}'
+        create_security_log_table(conn, f'archive.{table}')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{table}_created ON {table}(created_at)')
+        conn.executemany(f'''
+            INSERT OR IGNORE INTO archive.{table} ({SECURITY_LOG_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', month_rows)
+        copied[table] = [row[0] for row in month_rows]
+    return copied
+
+def delete_archived_security_logs(conn, copied):
+    """Writer job: delete copied logs from security_logs - only the ids the
+    (already committed) archive tables really contain. Returns the count."""
+    deleted = 0
+    for table, ids in copied.items():
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            deleted += conn.execute(f'''
+                DELETE FROM security_logs
+                WHERE id IN (SELECT id FROM archive.{table} WHERE id IN ({placeholders}))
+            ''', chunk).rowcount
+    return deleted
+
+def incremental_vacuum(conn, max_pages):
+    """Release up to max_pages free pages (writer job). Python's sqlite3 steps a
+    PRAGMA statement only once, and each step frees one page, so go page by page."""
+    free_pages = min(conn.execute('PRAGMA main.freelist_count').fetchone()[0], max_pages)
+    for _ in range(free_pages):
+        conn.execute('PRAGMA main.incremental_vacuum(1)')
+    return free_pages
+
+def archive_security_logs():
+    """Retention: archive logs past SECURITY_LOG_RETENTION_DAYS, then reclaim free pages"""
+    cutoff = (datetime.utcnow() - timedelta(days=app.config['SECURITY_LOG_RETENTION_DAYS'])).strftime('%Y-%m-%d %H:%M:%S')
+    batch_size = app.config['SECURITY_LOG_ARCHIVE_BATCH']
+    
+    # One bounded batch per write job so regular writes interleave with the move.
+    # run() returns after the copy is committed, so the delete only ever
+    # removes rows that are durable in the archive.
+    moved = 0
+    while True:
+        copied = db_writer.run(lambda conn: copy_security_log_batch(conn, cutoff, batch_size))
+        count = sum(len(ids) for ids in copied.values())
+        if count:
+            moved += db_writer.run(lambda conn: delete_archived_security_logs(conn, copied))
+        if count < batch_size:
+            break
+    
+    if moved:
+        security_log_count_cache.clear()
+        while db_writer.run(lambda conn: incremental_vacuum(conn, batch_size)) == batch_size:
+            pass
+        security_logger.info(f"Archived {moved} security logs older than {cutoff}")
+    return moved
+
+maintenance.register('archive_security_logs', app.config['MAINTENANCE_INTERVAL'], archive_security_logs)
+
+def security_log_source(conn, args):
+    """FROM clause for security log queries - the hot table, plus the monthly
+    archive tables overlapping the requested date range when there is one.
+    Only date_to set means the range starts before retention, so every archive
+    month up to date_to is included."""
+    date_from = args.get('date_from', '').strip()
+    date_to = args.get('date_to', '').strip()
+    if not date_from and not date_to:
+        return 'security_logs'
+    
+    start_month = parse_log_date(date_from)[:7].replace('-', '') if date_from else '000000'
+    end_month = parse_log_date(date_to, end_of_day=True)[:7].replace('-', '') if date_to else '999999'
+    tables = [table for table in security_log_archive_tables(conn)
+              if start_month <= table[-6:] <= end_month]
+    if not tables:
+        return 'security_logs'
+    
+    parts = [f'SELECT {SECURITY_LOG_COLUMNS} FROM security_logs']
+    parts += [f'SELECT {SECURITY_LOG_COLUMNS} FROM archive.{table}' for table in tables]
+    return '(' + ' UNION ALL '.join(parts) + ')'
+
+def security_log_select(source, columns='l.id, l.event_type, l.username, ip.ip_address, ua.user_agent, '
+                                         'l.success, l.details, l.created_at'):
+    """SELECT ... FROM a security log source (aliased l) with the interned IP and
+    user agent joined back in, so callers see the same columns as before"""
+    return f'''
+        SELECT {columns} FROM {source} l
+        LEFT JOIN log_ips ip ON ip.id = l.ip_id
+        LEFT JOIN log_user_agents ua ON ua.id = l.user_agent_id
+    '''
 
 def get_client_ip():
     """Get real client IP address (works with proxies)"""
@@ -69,17 +831,10 @@ def log_security_event(event_type, username, ip_address, user_agent, success, de
         f"SUCCESS: {success} | DETAILS: {details} | USER_AGENT: {user_agent}"
     )
     
-    # Log to database
-    try:
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO security_logs (event_type, username, ip_address, user_agent, success, details)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (event_type, username, ip_address, user_agent, success, details))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        security_logger.error(f"Failed to log to database: {e}")
+    # Log to database (batched in the background). ip_id is NOT NULL and one bad
+    # row would fail its whole batch, so a missing IP/user agent is stored as ''
+    created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    security_log_sink.add((event_type, username, ip_address or '', user_agent or '', success, details, created_at))
 
 def check_rate_limit(ip_address):
     """Check if IP is rate limited due to too many failed attempts"""
@@ -136,10 +891,36 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def init_db():
-    """Initialize database with tables"""
-    conn = get_db_connection()
-    
+def versioned(*tables):
+    """Decorator for GET routes whose response depends only on tables (and the user).
+
+    Tags responses with a strong ETag built from the tables' data versions and
+    answers a matching If-None-Match with 304 before the route runs.
+    Put it below login_required/admin_required so auth is checked first.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            versions = data_versions.get(tables)
+            key = json.dumps([request.full_path, session.get('user_id'), session.get('role'), versions])
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:32]
+            
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'  # always revalidate
+            return response
+        return decorated_function
+    return decorator
+
+# ==================== SCHEMA MIGRATIONS ====================
+
+def migrate_create_tables(conn):
+    """Create the base tables"""
     # Materials table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS materials (
@@ -218,7 +999,15 @@ def init_db():
             FOREIGN KEY (processed_by) REFERENCES users(id)
         )
     ''')
-    
+
+def migrate_add_max_threshold(conn):
+    """Add max_threshold column to databases created before it existed"""
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(materials)')]
+    if 'max_threshold' not in columns:
+        conn.execute('ALTER TABLE materials ADD COLUMN max_threshold INTEGER DEFAULT 50')
+
+def migrate_seed_data(conn):
+    """Create default accounts and sample data in an empty database"""
     # Create default users if no users exist
     user_count = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
     if user_count == 0:
@@ -236,21 +1025,11 @@ def init_db():
             VALUES (?, ?, ?, ?, ?)
         ''', ('user', user_password, 'Потребител', 'user', 'Училище'))
         
-        conn.commit()
         print("✅ Създадени акаунти:")
         print("   Admin: admin / Fenix@Admin2025!")
         print("   User:  user  / Fenix@User2025!")
         print("   ⚠️  ВАЖНО: Сменете паролите веднага!")
     
-    # Migration: Add max_threshold column if it doesn't exist
-    try:
-        conn.execute('SELECT max_threshold FROM materials LIMIT 1')
-    except:
-        print("🔄 Добавяне на колона max_threshold...")
-        conn.execute('ALTER TABLE materials ADD COLUMN max_threshold INTEGER DEFAULT 50')
-        conn.commit()
-        print("✅ Колоната max_threshold е добавена")
-    
     # Add some sample data if table is empty
     count = conn.execute('SELECT COUNT(*) FROM materials').fetchone()[0]
     if count == 0:
@@ -276,7 +1055,6 @@ def init_db():
             INSERT INTO materials (name, category, quantity, min_threshold, max_threshold, notes)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', sample_data)
-        conn.commit()
     
     # Add sample books if table is empty
     books_count = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
@@ -294,7 +1072,516 @@ def init_db():
             INSERT INTO books (subject, grade, publisher, author, quantity, min_threshold, notes, type)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', sample_books)
-        conn.commit()
+
+def migrate_add_indexes(conn):
+    """Indexes matching the list, stats and request queries"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_materials_category_name ON materials(category, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_grade_subject ON books(grade, subject)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_type ON books(type)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_publisher ON books(publisher)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_status_created ON material_requests(status, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_user_created ON material_requests(user_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_created ON security_logs(created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_event_created ON security_logs(event_type, created_at)')
+
+def migrate_security_log_filter_indexes(conn):
+    """Indexes for username/IP filtering of security logs"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_username_created ON security_logs(username, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_ip_created ON security_logs(ip_address, created_at)')
+
+def migrate_security_log_rollups(conn):
+    """Rollup tables for the security dashboard, backfilled from existing logs"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS security_log_hourly (
+            hour TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, event_type, success)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS security_log_daily_ip (
+            day TEXT NOT NULL,
+            ip_address TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, ip_address)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS security_log_daily_user (
+            day TEXT NOT NULL,
+            username TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, username)
+        ) WITHOUT ROWID
+    ''')
+    
+    sources = ['security_logs'] + [f'archive.{table}' for table in security_log_archive_tables(conn)]
+    for source in sources:
+        rows = conn.execute(f'''
+            SELECT event_type, username, ip_address, NULL, success, NULL, created_at FROM {source}
+        ''')
+        while True:
+            batch = rows.fetchmany(5000)
+            if not batch:
+                break
+            update_security_log_rollups(conn, [tuple(row) for row in batch])
+
+def migrate_intern_security_log_clients(conn):
+    """Store each distinct IP and user agent once and reference them by id from
+    security_logs and the archive tables (rebuilt in place, ids preserved)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_ips (
+            id INTEGER PRIMARY KEY,
+            ip_address TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS log_user_agents (
+            id INTEGER PRIMARY KEY,
+            user_agent TEXT NOT NULL UNIQUE
+        )
+    ''')
+    
+    # AUTOINCREMENT must not hand out ids of logs that were already archived
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'security_logs'").fetchone()
+    
+    tables = ['main.security_logs'] + [f'archive.{table}' for table in security_log_archive_tables(conn)]
+    for table in tables:
+        schema, name = table.split('.')
+        conn.execute(f'''
+            INSERT OR IGNORE INTO log_ips (ip_address)
+            SELECT DISTINCT ip_address FROM {table}
+        ''')
+        conn.execute(f'''
+            INSERT OR IGNORE INTO log_user_agents (user_agent)
+            SELECT DISTINCT user_agent FROM {table} WHERE user_agent IS NOT NULL
+        ''')
+        
+        create_security_log_table(conn, f'{table}_new', autoincrement=(name == 'security_logs'))
+        conn.execute(f'''
+            INSERT INTO {table}_new ({SECURITY_LOG_COLUMNS})
+            SELECT l.id, l.event_type, l.username, ip.id, ua.id, l.success, l.details, l.created_at
+            FROM {table} l
+            JOIN log_ips ip ON ip.ip_address = l.ip_address
+            LEFT JOIN log_user_agents ua ON ua.user_agent = l.user_agent
+        ''')
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_new RENAME TO {name}')
+        if schema == 'archive':
+            conn.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{name}_created ON {name}(created_at)')
+    
+    if sequence:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'security_logs'", (sequence['seq'],))
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'security_logs', ? "
+                     "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'security_logs')",
+                     (sequence['seq'],))
+    
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_created ON security_logs(created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_event_created ON security_logs(event_type, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_username_created ON security_logs(username, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_ip_created ON security_logs(ip_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_logs_user_agent_created ON security_logs(user_agent_id, created_at)')
+
+# Full-text indexes: table -> indexed columns. unicode61 folds case for Cyrillic
+# too (LOWER() only folds ASCII); the prefix indexes keep search-as-you-type fast.
+FTS_TABLES = {
+    'materials': ('name', 'notes'),
+    'books': ('subject', 'author', 'notes'),
+    'material_requests': ('notes', 'admin_notes'),
+    'users': ('username', 'full_name', 'company'),
+}
+
+def create_fts_index(conn, table, columns):
+    """External-content FTS5 index over table's columns, kept in sync by triggers"""
+    fts = f'{table}_fts'
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {column_list},
+            content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END
+    ''')
+    # Only text edits touch the index - quantity updates don't
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+    ''')
+    conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def migrate_add_search_indexes(conn):
+    """FTS5 search indexes for materials and books"""
+    for table in ('materials', 'books'):
+        create_fts_index(conn, table, FTS_TABLES[table])
+
+def migrate_add_global_search_indexes(conn):
+    """FTS5 search indexes for requests and users, for the global search"""
+    for table in ('material_requests', 'users'):
+        create_fts_index(conn, table, FTS_TABLES[table])
+    # Requests are also found by their material's name
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_requests_material ON material_requests(material_id)')
+
+def migrate_list_sort_indexes(conn):
+    """Indexes for the materials/books list sort keys"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_materials_name ON materials(name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_materials_quantity ON materials(quantity)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_materials_updated ON materials(updated_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_subject ON books(subject)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_quantity ON books(quantity)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_updated ON books(updated_at)')
+
+def migrate_add_stock_status(conn):
+    """Generated stock_status column (out/low/adequate/overstock) with indexes for
+    the status filters. Books have no max_threshold, so they are never overstock."""
+    conn.execute('''
+        ALTER TABLE materials ADD COLUMN stock_status TEXT GENERATED ALWAYS AS (
+            CASE
+                WHEN quantity <= 0 THEN 'out'
+                WHEN quantity <= min_threshold THEN 'low'
+                WHEN max_threshold IS NOT NULL AND quantity > max_threshold THEN 'overstock'
+                ELSE 'adequate'
+            END
+        ) VIRTUAL
+    ''')
+    conn.execute('''
+        ALTER TABLE books ADD COLUMN stock_status TEXT GENERATED ALWAYS AS (
+            CASE
+                WHEN quantity <= 0 THEN 'out'
+                WHEN quantity <= min_threshold THEN 'low'
+                ELSE 'adequate'
+            END
+        ) VIRTUAL
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_materials_status ON materials(stock_status, category, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_type_status ON books(type, stock_status, grade, subject)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_books_status ON books(stock_status, grade, subject)')
+
+def counter_change(scope, bucket, delta):
+    """Trigger statement adding delta to an inventory_counters row"""
+    return f'''
+            INSERT INTO inventory_counters (scope, bucket, count) VALUES ({scope}, {bucket}, {delta})
+            ON CONFLICT (scope, bucket) DO UPDATE SET count = count + ({delta});'''
+
+def migrate_add_inventory_counters(conn):
+    """Counters behind the stats endpoints, kept exact by triggers: materials per
+    stock status, books per type and stock status, requests per status"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_counters (
+            scope TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, bucket)
+        ) WITHOUT ROWID
+    ''')
+    
+    # (table, scope SQL, bucket column, columns that can move a row to another bucket)
+    counted = [
+        ('materials', "'materials'", 'stock_status', 'quantity, min_threshold, max_threshold'),
+        ('books', "'books:' || {row}.type", 'stock_status', 'quantity, min_threshold, type'),
+        ('material_requests', "'material_requests'", 'status', 'status'),
+    ]
+    for table, scope, bucket, columns in counted:
+        new_scope, old_scope = scope.format(row='new'), scope.format(row='old')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_counters_ai AFTER INSERT ON {table} BEGIN
+                {counter_change(new_scope, f'new.{bucket}', 1)}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_counters_ad AFTER DELETE ON {table} BEGIN
+                {counter_change(old_scope, f'old.{bucket}', -1)}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_counters_au AFTER UPDATE OF {columns} ON {table}
+            WHEN {old_scope} IS NOT {new_scope} OR old.{bucket} IS NOT new.{bucket} BEGIN
+                {counter_change(old_scope, f'old.{bucket}', -1)}
+                {counter_change(new_scope, f'new.{bucket}', 1)}
+            END
+        ''')
+        conn.execute(f'''
+            INSERT INTO inventory_counters (scope, bucket, count)
+            SELECT {scope.format(row=table)}, {bucket}, COUNT(*) FROM {table} GROUP BY 1, 2
+        ''')
+
+VERSIONED_TABLES = ('materials', 'books', 'material_requests', 'users')
+
+def migrate_add_data_versions(conn):
+    """Per-table version counters for conditional GETs, bumped by triggers"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in VERSIONED_TABLES:
+        conn.execute('INSERT OR IGNORE INTO data_versions (name) VALUES (?)', (table,))
+        for suffix, event in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+STOCK_TABLES = ('materials', 'books')
+
+def migrate_add_stock_ledger(conn):
+    """Append-only stock movement ledger written by triggers on every quantity
+    change, plus checkpoint snapshots for point-in-time queries"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_movements (
+            id INTEGER PRIMARY KEY,
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            source TEXT,
+            actor TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_item ON stock_movements(item_type, item_id, created_at)')
+    
+    # One row, set by run_write(reason=...) for the duration of a write job
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_movement_context (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            reason TEXT NOT NULL,
+            source TEXT,
+            actor TEXT
+        )
+    ''')
+    
+    # Quantities of every stocked item as of ledger position last_movement_id
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+            id INTEGER PRIMARY KEY,
+            last_movement_id INTEGER NOT NULL,
+            taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_snapshots_taken ON stock_snapshots(taken_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_snapshot_items (
+            snapshot_id INTEGER NOT NULL,
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, item_type, item_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    for table in STOCK_TABLES:
+        def movement(row, delta, quantity, default_reason):
+            return f'''
+                INSERT INTO stock_movements (item_type, item_id, delta, quantity, reason, source, actor)
+                SELECT '{table}', {row}.id, {delta}, {quantity}, COALESCE(c.reason, '{default_reason}'), c.source, c.actor
+                FROM (SELECT 1) LEFT JOIN stock_movement_context c ON c.id = 1;
+            '''
+        
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_movements_ai AFTER INSERT ON {table}
+            WHEN new.quantity != 0 BEGIN
+                {movement('new', 'new.quantity', 'new.quantity', 'create')}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_movements_au AFTER UPDATE OF quantity ON {table}
+            WHEN new.quantity IS NOT old.quantity BEGIN
+                {movement('new', 'new.quantity - old.quantity', 'new.quantity', 'edit')}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_movements_ad AFTER DELETE ON {table}
+            WHEN old.quantity != 0 BEGIN
+                {movement('old', '-old.quantity', '0', 'delete')}
+            END
+        ''')
+        
+        # Opening balances, so the ledger always sums to the current quantities
+        conn.execute(f'''
+            INSERT INTO stock_movements (item_type, item_id, delta, quantity, reason)
+            SELECT '{table}', id, quantity, quantity, 'opening' FROM {table} WHERE quantity != 0
+        ''')
+
+def migrate_add_stock_levels(conn):
+    """Daily/weekly/monthly stock level rollups for the trend charts, per item
+    and per material category (filled from the ledger by rollup_stock_levels)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS item_levels (
+            item_type TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            low INTEGER NOT NULL,
+            high INTEGER NOT NULL,
+            close INTEGER NOT NULL,
+            PRIMARY KEY (item_type, item_id, grain, period)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS category_levels (
+            category TEXT NOT NULL,
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            low INTEGER NOT NULL,
+            high INTEGER NOT NULL,
+            close INTEGER NOT NULL,
+            items INTEGER NOT NULL,
+            PRIMARY KEY (category, grain, period)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_item_levels_grain ON item_levels(grain, period)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_category_levels_grain ON category_levels(grain, period)')
+    
+    # Days already rolled up
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_level_days (
+            day TEXT PRIMARY KEY,
+            rolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # A day's movements are read by time range
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_created ON stock_movements(created_at)')
+
+PENDING_REQUESTED = '''(SELECT COALESCE(SUM(requested_quantity), 0) FROM material_requests
+             WHERE material_id = {material} AND status = 'pending')'''
+
+def migrate_add_reorder_queue(conn):
+    """Reorder queue - the materials at or below min_threshold with their pending
+    requested quantity - kept current by triggers instead of scanning on read"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reorder_queue (
+            material_id INTEGER PRIMARY KEY,
+            pending INTEGER NOT NULL DEFAULT 0,
+            queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS materials_reorder_ai AFTER INSERT ON materials
+        WHEN new.stock_status IN ('out', 'low') BEGIN
+            INSERT INTO reorder_queue (material_id) VALUES (new.id);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS materials_reorder_au AFTER UPDATE OF quantity, min_threshold ON materials
+        WHEN (old.stock_status IN ('out', 'low')) IS NOT (new.stock_status IN ('out', 'low')) BEGIN
+            DELETE FROM reorder_queue WHERE material_id = old.id;
+            INSERT INTO reorder_queue (material_id, pending)
+            SELECT new.id, {PENDING_REQUESTED.format(material='new.id')}
+            WHERE new.stock_status IN ('out', 'low');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS materials_reorder_ad AFTER DELETE ON materials BEGIN
+            DELETE FROM reorder_queue WHERE material_id = old.id;
+        END
+    ''')
+    
+    # Requests only touch queued materials (one indexed lookup per changed request)
+    refresh_pending = f'''
+            UPDATE reorder_queue SET pending = {PENDING_REQUESTED.format(material='reorder_queue.material_id')}
+            WHERE material_id IN ({{materials}});'''
+    for suffix, event, materials in (('ai', 'INSERT', 'new.material_id'),
+                                     ('ad', 'DELETE', 'old.material_id'),
+                                     ('au', 'UPDATE OF status, requested_quantity, material_id',
+                                      'old.material_id, new.material_id')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS material_requests_reorder_{suffix} AFTER {event} ON material_requests BEGIN
+                {refresh_pending.format(materials=materials)}
+            END
+        ''')
+    
+    conn.execute(f'''
+        INSERT INTO reorder_queue (material_id, pending)
+        SELECT id, {PENDING_REQUESTED.format(material='materials.id')}
+        FROM materials WHERE stock_status IN ('out', 'low')
+    ''')
+
+# Ordered schema migrations: (version, description, function).
+# Append new steps at the end - never renumber or edit an applied step.
+MIGRATIONS = [
+    (1, 'Create base tables', migrate_create_tables),
+    (2, 'Add materials.max_threshold', migrate_add_max_threshold),
+    (3, 'Seed default accounts and sample data', migrate_seed_data),
+    (4, 'Add indexes for hot queries', migrate_add_indexes),
+    (5, 'Add security log username/IP indexes', migrate_security_log_filter_indexes),
+    (6, 'Add security log rollups', migrate_security_log_rollups),
+    (7, 'Intern security log IPs and user agents', migrate_intern_security_log_clients),
+    (8, 'Add full-text search indexes', migrate_add_search_indexes),
+    (9, 'Add global search indexes', migrate_add_global_search_indexes),
+    (10, 'Add list sort indexes', migrate_list_sort_indexes),
+    (11, 'Add stock status column', migrate_add_stock_status),
+    (12, 'Add trigger-maintained inventory counters', migrate_add_inventory_counters),
+    (13, 'Add data versions for conditional GETs', migrate_add_data_versions),
+    (14, 'Add stock movement ledger and snapshots', migrate_add_stock_ledger),
+    (15, 'Add stock level rollups', migrate_add_stock_levels),
+    (16, 'Add reorder queue', migrate_add_reorder_queue),
+]
+
+def run_migrations(conn):
+    """Apply pending migrations, each in its own transaction"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        print(f"🔄 Миграция {version}: {description}")
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migrate(conn)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                         (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def init_db():
+    """Initialize database - apply any pending schema migrations"""
+    # Migrations need a writable connection of their own (pooled ones are query_only)
+    conn = db_pool.connect()
+    run_migrations(conn)
+    
+    # Incremental auto-vacuum lets retention hand freed pages back to the OS.
+    # Switching an existing database needs one full VACUUM (outside a transaction).
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        print("🔄 Включване на incremental auto-vacuum...")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    else:
+        # Hand back pages freed by migrations that rebuilt tables
+        incremental_vacuum(conn, conn.execute('PRAGMA main.freelist_count').fetchone()[0])
     
     conn.close()
 
@@ -368,10 +1655,8 @@ def login():
         session['company'] = user['company']
         
         # Update last login
-        conn = get_db_connection()
-        conn.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user['id'],))
-        conn.commit()
-        conn.close()
+        run_write(lambda conn: conn.execute(
+            'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user['id'],)))
         
         # Reset failed attempts
         reset_login_attempts(ip_address)
@@ -461,15 +1746,15 @@ def create_user():
     
     password_hash = generate_password_hash(data['password'])
     
-    try:
-        conn = get_db_connection()
+    def insert_user(conn):
         cursor = conn.execute('''
             INSERT INTO users (username, password_hash, full_name, role, company)
             VALUES (?, ?, ?, ?, ?)
         ''', (data['username'], password_hash, data['full_name'], data['role'], data.get('company', '')))
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
+        return cursor.lastrowid
+    
+    try:
+        user_id = run_write(insert_user)
         return jsonify({'id': user_id, 'message': 'User created successfully'}), 201
     except sqlite3.IntegrityError:
         return jsonify({'error': 'Username already exists'}), 400
@@ -480,8 +1765,6 @@ def update_user(user_id):
     """Update user (admin only)"""
     data = request.get_json()
     
-    conn = get_db_connection()
-    
     # Build update query
     updates = []
     params = []
@@ -502,10 +1785,8 @@ def update_user(user_id):
     if updates:
         params.append(user_id)
         query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
-        conn.execute(query, params)
-        conn.commit()
+        run_write(lambda conn: conn.execute(query, params))
     
-    conn.close()
     return jsonify({'message': 'User updated successfully'})
 
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
@@ -516,10 +1797,7 @@ def delete_user(user_id):
     if user_id == session['user_id']:
         return jsonify({'error': 'Cannot delete your own account'}), 400
     
-    conn = get_db_connection()
-    conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: conn.execute('DELETE FROM users WHERE id = ?', (user_id,)))
     
     return jsonify({'message': 'User deleted successfully'})
 
@@ -549,14 +1827,13 @@ def change_password():
         
         # Admin changing other user's password (no current password needed)
         target_user = conn.execute('SELECT username FROM users WHERE id = ?', (target_user_id,)).fetchone()
+        conn.close()
         if not target_user:
-            conn.close()
             return jsonify({'error': 'Потребителят не съществува'}), 404
         
         new_hash = generate_password_hash(new_password)
-        conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, target_user_id))
-        conn.commit()
-        conn.close()
+        run_write(lambda conn: conn.execute(
+            'UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, target_user_id)))
         
         log_security_event('PASSWORD_CHANGED_BY_ADMIN', target_user['username'], ip_address, 
                          user_agent, True, f"Admin {session['username']} changed password")
@@ -577,95 +1854,652 @@ def change_password():
                          user_agent, False, 'Invalid current password')
         return jsonify({'error': 'Грешна текуща парола'}), 401
     
+    conn.close()
+    
     # Update password
     new_hash = generate_password_hash(new_password)
-    conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, session['user_id']))
-    conn.commit()
-    conn.close()
+    user_id = session['user_id']
+    run_write(lambda conn: conn.execute(
+        'UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, user_id)))
     
     log_security_event('PASSWORD_CHANGED', user['username'], ip_address, 
                      user_agent, True, 'User changed own password')
     
     return jsonify({'message': 'Паролата е променена успешно'})
 
+# Total counts for the security log list are cached briefly per filter combination,
+# so paging through results doesn't re-count the whole table on every request
+app.config['SECURITY_LOG_COUNT_TTL'] = 60  # seconds
+security_log_count_cache = TTLCache(maxsize=256, ttl=app.config['SECURITY_LOG_COUNT_TTL'])
+
+def encode_cursor(values):
+    """Opaque pagination cursor from the last row's sort key"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Sort key from a cursor - raises ValueError if it is malformed"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+CURSOR_SCALARS = (str, int, float, type(None))
+
+def check_cursor(values, kinds):
+    """values (a decoded cursor) if it is a list with one value per entry of
+    kinds, each an instance of that entry's type(s) - raises ValueError otherwise"""
+    if not isinstance(values, list) or len(values) != len(kinds):
+        raise ValueError('Invalid cursor')
+    for value, kind in zip(values, kinds):
+        if isinstance(value, bool) or not isinstance(value, kind):
+            raise ValueError('Invalid cursor')
+    return values
+
+def parse_log_date(value, end_of_day=False):
+    """Normalize a date/datetime filter to the 'YYYY-MM-DD HH:MM:SS' format of created_at"""
+    parsed = datetime.fromisoformat(value.strip())
+    if end_of_day and len(value.strip()) == 10:
+        # A plain date as the upper bound includes the whole day
+        parsed += timedelta(days=1)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+def build_security_log_filters(args):
+    """WHERE conditions and params for the security log filters in request args.
+
+    username matches by prefix (username_match=exact for an exact match) so the
+    (username, created_at) index can be used. ip and user_agent match exactly,
+    through their interned ids. date_from is inclusive, date_to is exclusive (a
+    plain date includes that whole day). Raises ValueError on bad input.
+    """
+    conditions = []
+    params = []
+    
+    event_type = args.get('event_type', '').strip()
+    if event_type:
+        conditions.append('event_type = ?')
+        params.append(event_type)
+    
+    username = args.get('username', '').strip()
+    if username:
+        if args.get('username_match', 'prefix') == 'exact':
+            conditions.append('username = ?')
+            params.append(username)
+        else:
+            conditions.append('username >= ? AND username < ?')
+            params.extend([username, username + '\U0010ffff'])
+    
+    ip_address = args.get('ip', '').strip()
+    if ip_address:
+        conditions.append('ip_id = (SELECT id FROM log_ips WHERE ip_address = ?)')
+        params.append(ip_address)
+    
+    user_agent = args.get('user_agent', '').strip()
+    if user_agent:
+        conditions.append('user_agent_id = (SELECT id FROM log_user_agents WHERE user_agent = ?)')
+        params.append(user_agent)
+    
+    date_from = args.get('date_from', '').strip()
+    if date_from:
+        conditions.append('created_at >= ?')
+        params.append(parse_log_date(date_from))
+    
+    date_to = args.get('date_to', '').strip()
+    if date_to:
+        conditions.append('created_at < ?')
+        params.append(parse_log_date(date_to, end_of_day=True))
+    
+    return conditions, params
+
 @app.route('/api/security-logs', methods=['GET'])
 @admin_required
 def get_security_logs():
-    """Get security logs (admin only)"""
-    limit = request.args.get('limit', 100, type=int)
+    """Get security logs, newest first (admin only).
+
+    Pages with keyset pagination: pass the returned next_cursor as ?cursor= to
+    get the next page. The total is cached for SECURITY_LOG_COUNT_TTL seconds.
+    Archived months are included only when date_from reaches back into them.
+    """
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
     offset = request.args.get('offset', 0, type=int)
-    event_type = request.args.get('event_type', '')
-    username = request.args.get('username', '')
+    cursor = request.args.get('cursor', '')
+    
+    try:
+        conditions, params = build_security_log_filters(request.args)
+        # The cursor is the last row's (created_at, id)
+        after = check_cursor(decode_cursor(cursor), (str, int)) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     conn = get_db_connection()
+    source = security_log_source(conn, request.args)
+    
+    # Get total count (cached per filter combination)
+    count_key = (source, tuple(conditions), tuple(params))
+    total = security_log_count_cache.get(count_key)
+    if total is None:
+        count_query = f'SELECT COUNT(*) as total FROM {source} l'
+        if conditions:
+            count_query += ' WHERE ' + ' AND '.join(conditions)
+        total = conn.execute(count_query, params).fetchone()['total']
+        security_log_count_cache.set(count_key, total)
+    
+    query = security_log_select(source)
+    if after:
+        conditions = conditions + ['(l.created_at, l.id) < (?, ?)']
+        params = params + after
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY l.created_at DESC, l.id DESC LIMIT ?'
+    params = params + [limit]
+    if offset and not after:
+        # Legacy offset paging - still supported, but deep offsets are slow
+        query += ' OFFSET ?'
+        params.append(offset)
+    
+    logs = [dict(row) for row in conn.execute(query, params).fetchall()]
+    conn.close()
     
-    query = 'SELECT * FROM security_logs WHERE 1=1'
-    params = []
+    next_cursor = None
+    if len(logs) == limit:
+        next_cursor = encode_cursor([logs[-1]['created_at'], logs[-1]['id']])
     
-    if event_type:
-        query += ' AND event_type = ?'
-        params.append(event_type)
+    return jsonify({
+        'logs': logs,
+        'total': total,
+        'limit': limit,
+        'offset': offset,
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/security-logs/<int:log_id>', methods=['GET'])
+@admin_required
+def get_security_log(log_id):
+    """Get a single security log (admin only).
+
+    With ?neighbours=true the response also has the ids of the next newer and
+    older log, honouring the same filters as the list, for prev/next navigation.
+    """
+    conn = get_db_connection()
+    log = conn.execute(security_log_select('security_logs') + ' WHERE l.id = ?', (log_id,)).fetchone()
     
-    if username:
-        query += ' AND username LIKE ?'
-        params.append(f'%{username}%')
+    # Not in the hot table - it may have been archived
+    if log is None:
+        for table in reversed(security_log_archive_tables(conn)):
+            log = conn.execute(security_log_select(f'archive.{table}') + ' WHERE l.id = ?', (log_id,)).fetchone()
+            if log is not None:
+                break
     
-    query += ' ORDER BY created_at DESC LIMIT ? OFFSET ?'
-    params.extend([limit, offset])
+    if log is None:
+        conn.close()
+        return jsonify({'error': 'Log not found'}), 404
     
-    logs = conn.execute(query, params).fetchall()
+    result = dict(log)
     
-    # Get total count
-    count_query = 'SELECT COUNT(*) as total FROM security_logs WHERE 1=1'
-    count_params = []
-    if event_type:
-        count_query += ' AND event_type = ?'
-        count_params.append(event_type)
-    if username:
-        count_query += ' AND username LIKE ?'
-        count_params.append(f'%{username}%')
+    if request.args.get('neighbours', '').lower() == 'true':
+        try:
+            conditions, params = build_security_log_filters(request.args)
+            source = security_log_source(conn, request.args)
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
+        
+        key = [log['created_at'], log['id']]
+        where = ' AND '.join(conditions + ['(l.created_at, l.id) > (?, ?)'])
+        newer = conn.execute(f'''
+            SELECT l.id FROM {source} l WHERE {where}
+            ORDER BY l.created_at, l.id LIMIT 1
+        ''', params + key).fetchone()
+        where = ' AND '.join(conditions + ['(l.created_at, l.id) < (?, ?)'])
+        older = conn.execute(f'''
+            SELECT l.id FROM {source} l WHERE {where}
+            ORDER BY l.created_at DESC, l.id DESC LIMIT 1
+        ''', params + key).fetchone()
+        
+        result['neighbours'] = {
+            'newer': newer['id'] if newer else None,
+            'older': older['id'] if older else None
+        }
+    
+    conn.close()
+    return jsonify(result)
+
+SECURITY_LOG_EXPORT_CHUNK = 1000  # rows fetched from the cursor per streamed chunk
+
+@app.route('/api/security-logs/export', methods=['GET'])
+@admin_required
+def export_security_logs():
+    """Stream security logs as CSV (or NDJSON with ?format=ndjson) - admin only.
+
+    Takes the same filters as the list. Rows are streamed from a database
+    cursor in chunks, so memory use doesn't depend on how many rows match.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Format must be csv or ndjson'}), 400
+    
+    try:
+        conditions, params = build_security_log_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    args = request.args.copy()
+    
+    def generate():
+        # Own connection: the response outlives the request's pooled connection
+        conn = db_pool.connect(query_only=True)
+        try:
+            source = security_log_source(conn, args)
+            query = security_log_select(source, 'l.id, l.created_at, l.event_type, l.username, ip.ip_address, '
+                                                'l.success, l.details, ua.user_agent')
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+            query += ' ORDER BY l.created_at DESC, l.id DESC'
+            cursor = conn.execute(query, params)
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                buffer.write('\ufeff')  # BOM so Excel opens the file as UTF-8
+                writer.writerow(['ID', 'Дата и час', 'Тип', 'Потребител', 'IP адрес', 'Успешно', 'Детайли', 'User Agent'])
+            
+            while True:
+                rows = cursor.fetchmany(SECURITY_LOG_EXPORT_CHUNK)
+                if not rows:
+                    break
+                if export_format == 'csv':
+                    writer.writerows([
+                        (row['id'], row['created_at'], row['event_type'], row['username'], row['ip_address'],
+                         'Да' if row['success'] else 'Не', row['details'] or '', row['user_agent'] or '')
+                        for row in rows
+                    ])
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    yield ''.join(json.dumps(dict(row), ensure_ascii=False) + '\n' for row in rows)
+            
+            if export_format == 'csv' and buffer.tell():
+                yield buffer.getvalue()
+        finally:
+            conn.close()
+    
+    filename = f'security_logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/security-logs/rollups', methods=['GET'])
+@admin_required
+def get_security_log_rollups():
+    """Get pre-aggregated security log counts (admin only).
+
+    ?kind=hourly  - counts per hour, event type and success
+    ?kind=ip      - total/failed events per IP per day
+    ?kind=user    - total/failed events per username per day
+    Range: date_from/date_to (dates, date_to inclusive), default the last 7 days.
+    ip/user rows come most-failed first, up to ?limit= (default 100).
+    """
+    kind = request.args.get('kind', 'hourly')
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    
+    try:
+        date_from = datetime.fromisoformat(request.args.get('date_from', '').strip()).date() \
+            if request.args.get('date_from', '').strip() else (datetime.utcnow() - timedelta(days=7)).date()
+        date_to = datetime.fromisoformat(request.args.get('date_to', '').strip()).date() \
+            if request.args.get('date_to', '').strip() else datetime.utcnow().date()
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    day_from = date_from.isoformat()
+    day_to = (date_to + timedelta(days=1)).isoformat()
+    
+    conn = get_db_connection()
     
-    total = conn.execute(count_query, count_params).fetchone()['total']
+    if kind == 'hourly':
+        query = '''
+            SELECT hour, event_type, success, count FROM security_log_hourly
+            WHERE hour >= ? AND hour < ?
+        '''
+        params = [day_from, day_to]
+        event_type = request.args.get('event_type', '').strip()
+        if event_type:
+            query += ' AND event_type = ?'
+            params.append(event_type)
+        query += ' ORDER BY hour, event_type, success'
+    elif kind in ('ip', 'user'):
+        table, column = ('security_log_daily_ip', 'ip_address') if kind == 'ip' else ('security_log_daily_user', 'username')
+        query = f'''
+            SELECT {column}, SUM(total) as total, SUM(failed) as failed FROM {table}
+            WHERE day >= ? AND day < ?
+            GROUP BY {column}
+            ORDER BY failed DESC, total DESC
+            LIMIT ?
+        '''
+        params = [day_from, day_to, limit]
+    else:
+        conn.close()
+        return jsonify({'error': 'kind must be hourly, ip or user'}), 400
+    
+    rows = conn.execute(query, params).fetchall()
     conn.close()
     
     return jsonify({
-        'logs': [dict(row) for row in logs],
-        'total': total,
+        'kind': kind,
+        'date_from': day_from,
+        'date_to': date_to.isoformat(),
+        'rows': [dict(row) for row in rows]
+    })
+
+@app.route('/api/admin/logging-stats', methods=['GET'])
+@admin_required
+def get_logging_stats():
+    """Get security logging pipeline counters (admin only)"""
+    return jsonify({
+        'database': dict(security_log_sink.stats, pending=security_log_sink.pending()),
+        'file': {
+            'dropped': log_queue_handler.dropped,
+            'pending': log_queue_handler.queue.qsize()
+        }
+    })
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    """Get in-process cache sizes and hit/miss counters (admin only)"""
+    return jsonify({
+        'lookups': lookup_cache.stats(),
+        'security_log_counts': security_log_count_cache.stats()
+    })
+
+# ==================== SEARCH ====================
+
+def fts_match_query(text):
+    """FTS5 MATCH expression for user input: every word must match, each as a
+    prefix (search-as-you-type). Returns None if the text has no words."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+def fts_snippet(fts, column=-1):
+    """SQL for a short FTS5 excerpt around the match, with sentinel markers"""
+    return f"snippet({fts}, {column}, char(2), char(3), '…', 12)"
+
+def highlight_snippet(snippet):
+    """HTML-escape an excerpt and turn its sentinel markers into <mark> tags"""
+    return html.escape(snippet or '').replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+# Global search sources: type -> SELECTs of (type, id, rank, title, subtitle, snippet),
+# each taking one MATCH parameter. Requests match on their own notes or their material's name.
+SEARCH_SOURCES = {
+    'material': [f'''
+        SELECT 'material' as type, m.id, bm25(materials_fts, 10.0, 1.0) as rank, m.name as title,
+               m.category as subtitle, {fts_snippet('materials_fts')} as snippet
+        FROM materials_fts JOIN materials m ON m.id = materials_fts.rowid
+        WHERE materials_fts MATCH ?
+    '''],
+    'book': [f'''
+        SELECT 'book' as type, b.id, bm25(books_fts, 10.0, 5.0, 1.0) as rank, b.subject as title,
+               b.grade || ' клас, ' || b.publisher as subtitle, {fts_snippet('books_fts')} as snippet
+        FROM books_fts JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ?
+    '''],
+    'request': [f'''
+        SELECT 'request' as type, r.id, bm25(material_requests_fts) as rank, m.name as title,
+               r.status as subtitle, {fts_snippet('material_requests_fts')} as snippet
+        FROM material_requests_fts
+        JOIN material_requests r ON r.id = material_requests_fts.rowid
+        JOIN materials m ON m.id = r.material_id
+        WHERE material_requests_fts MATCH ? {{request_scope}}
+    ''', f'''
+        SELECT 'request' as type, r.id, bm25(materials_fts, 10.0, 1.0) as rank, m.name as title,
+               r.status as subtitle, {fts_snippet('materials_fts')} as snippet
+        FROM materials_fts
+        JOIN material_requests r ON r.material_id = materials_fts.rowid
+        JOIN materials m ON m.id = r.material_id
+        WHERE materials_fts MATCH ? {{request_scope}}
+    '''],
+    'user': [f'''
+        SELECT 'user' as type, u.id, bm25(users_fts, 5.0, 10.0, 1.0) as rank, u.full_name as title,
+               u.username as subtitle, {fts_snippet('users_fts')} as snippet
+        FROM users_fts JOIN users u ON u.id = users_fts.rowid
+        WHERE users_fts MATCH ?
+    '''],
+}
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def global_search():
+    """Search materials, books, requests and users in one call.
+
+    Hits of all types are ranked together (best first) and paged with
+    limit/offset. ?types=material,book limits the types searched. Users are
+    searched for admins only, and regular users only see their own requests.
+    Each hit has a snippet with the matched words in <mark> tags (HTML-escaped).
+    """
+    match = fts_match_query(request.args.get('q', ''))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    is_admin = session.get('role') == 'admin'
+    allowed = [t for t in SEARCH_SOURCES if is_admin or t != 'user']
+    types = request.args.get('types', '').strip()
+    if types:
+        requested = [t.strip() for t in types.split(',') if t.strip()]
+        unknown = [t for t in requested if t not in SEARCH_SOURCES]
+        if unknown:
+            return jsonify({'error': f"Unknown type: {', '.join(unknown)}"}), 400
+        allowed = [t for t in allowed if t in requested]
+    
+    if not match or not allowed:
+        return jsonify({'query': request.args.get('q', ''), 'results': [], 'total': 0,
+                        'counts': {}, 'limit': limit, 'offset': offset})
+    
+    parts = []
+    params = []
+    for search_type in allowed:
+        for part in SEARCH_SOURCES[search_type]:
+            scope = '' if is_admin else 'AND r.user_id = ?'
+            parts.append(part.format(request_scope=scope))
+            params.append(match)
+            if search_type == 'request' and not is_admin:
+                params.append(session['user_id'])
+    
+    # bm25()/snippet() only work in the FTS queries themselves, so those are
+    # materialized before ranking. A request matching both by notes and by
+    # material name counts once, at its best rank.
+    hits = f'''
+        WITH matches AS MATERIALIZED ({' UNION ALL '.join(parts)}),
+        hits AS (
+            SELECT type, id, MIN(rank) as rank, title, subtitle, snippet
+            FROM matches GROUP BY type, id
+        )
+    '''
+    
+    conn = get_db_connection()
+    counts = {row['type']: row['count'] for row in conn.execute(
+        f'{hits} SELECT type, COUNT(*) as count FROM hits GROUP BY type', params
+    ).fetchall()}
+    rows = conn.execute(f'{hits} SELECT * FROM hits ORDER BY rank, type, id LIMIT ? OFFSET ?',
+                        params + [limit, offset]).fetchall()
+    conn.close()
+    
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['snippet'] = highlight_snippet(row['snippet'])
+        results.append(result)
+    
+    return jsonify({
+        'query': request.args.get('q', ''),
+        'results': results,
+        'total': sum(counts.values()),
+        'counts': counts,
         'limit': limit,
         'offset': offset
     })
 
+# ==================== LIST QUERIES ====================
+
+MATERIAL_COLUMNS = ('id', 'name', 'category', 'quantity', 'min_threshold', 'max_threshold',
+                    'notes', 'created_at', 'updated_at', 'stock_status')
+BOOK_COLUMNS = ('id', 'subject', 'grade', 'publisher', 'author', 'quantity', 'min_threshold',
+                'notes', 'type', 'created_at', 'updated_at', 'stock_status')
+
+STOCK_STATUSES = ('out', 'low', 'adequate', 'overstock')
+
+def stock_status_filter(args):
+    """WHERE condition and params for ?status=low,out (or the older ?low_stock=true,
+    which is out + low). Returns (None, []) without a filter; ValueError on bad input."""
+    status = args.get('status', '').strip()
+    if status:
+        statuses = [value.strip() for value in status.split(',') if value.strip()]
+        unknown = [value for value in statuses if value not in STOCK_STATUSES]
+        if unknown:
+            raise ValueError(f"Status must be one of: {', '.join(STOCK_STATUSES)}")
+    elif args.get('low_stock', '').lower() == 'true':
+        statuses = ['out', 'low']
+    else:
+        return None, []
+    return f"stock_status IN ({', '.join('?' * len(statuses))})", statuses
+
+# Whitelisted ?sort= keys -> ORDER BY columns (each backed by an index; id breaks ties)
+MATERIAL_SORTS = {
+    'category': ('category', 'name'),
+    'name': ('name',),
+    'quantity': ('quantity',),
+    'updated_at': ('updated_at',),
+}
+BOOK_SORTS = {
+    'grade': ('grade', 'subject'),
+    'name': ('subject',),
+    'quantity': ('quantity',),
+    'updated_at': ('updated_at',),
+}
+
+def fetch_list(conn, table, source, params, args, columns, sorts, default_sort, rank=None):
+    """Run a list query with the sort/order, fields and limit/cursor request args.
+
+    source is the FROM ... WHERE ... part. Returns (items, page): page is None
+    when neither limit nor cursor was given (the whole list is returned, as
+    before), otherwise {'limit', 'next_cursor'}. rank is the ORDER BY of a
+    full-text search, used unless a sort is requested. Raises ValueError on bad input.
+    """
+    fields = args.get('fields', '').strip()
+    if fields:
+        selected = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in selected if field not in columns]
+        if unknown:
+            raise ValueError(f"Unknown field: {', '.join(unknown)}")
+        if 'id' not in selected:
+            selected.insert(0, 'id')
+    else:
+        selected = list(columns)
+    
+    sort = args.get('sort', '').strip()
+    if sort and sort not in sorts:
+        raise ValueError(f"Sort must be one of: {', '.join(sorts)}")
+    order = args.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('Order must be asc or desc')
+    
+    limit = args.get('limit', type=int)
+    cursor = args.get('cursor', '')
+    paged = limit is not None or bool(cursor)
+    limit = max(1, min(limit or 100, 1000))
+    
+    key = list(sorts[sort or default_sort]) + ['id']
+    hidden = [column for column in key if column not in selected]
+    query = f"SELECT {', '.join(f'{table}.{column}' for column in selected + hidden)} {source}"
+    params = list(params)
+    
+    ranked = rank is not None and not sort
+    # Ranked pages resume from a position, sorted ones from the last row's key
+    after = check_cursor(decode_cursor(cursor), [int] if ranked else [CURSOR_SCALARS] * len(key)) if cursor else None
+    if ranked:
+        # Ranked search results have no sort key to resume from - their cursor is a position
+        query += f" ORDER BY {rank}, {', '.join(f'{table}.{column}' for column in key)}"
+        offset = max(after[0], 0) if after else 0
+        if paged:
+            query += ' LIMIT ? OFFSET ?'
+            params += [limit, offset]
+    else:
+        direction = ' DESC' if order == 'desc' else ''
+        if after:
+            query += f" AND ({', '.join(f'{table}.{column}' for column in key)}) {'<' if direction else '>'} " \
+                     f"({', '.join('?' * len(key))})"
+            params += after
+        query += ' ORDER BY ' + ', '.join(f'{table}.{column}{direction}' for column in key)
+        if paged:
+            query += ' LIMIT ?'
+            params.append(limit)
+    
+    rows = conn.execute(query, params).fetchall()
+    items = [{column: row[column] for column in selected} for row in rows]
+    
+    if not paged:
+        return items, None
+    
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor([offset + limit] if ranked else [last[column] for column in key])
+    return items, {'limit': limit, 'next_cursor': next_cursor}
+
 # ==================== MATERIALS ROUTES ====================
 
 @app.route('/api/materials', methods=['GET'])
 @login_required
+@versioned('materials')
 def get_materials():
-    """Get all materials with optional filtering"""
-    search = request.args.get('search', '').strip().lower()  # Convert to lowercase
+    """Get all materials with optional filtering.
+
+    ?status=out,low,adequate,overstock filters by stock status (low_stock=true is
+    out + low). ?sort=category|name|quantity|updated_at&order=asc|desc sorts,
+    ?fields=id,name,... returns only those columns. With ?limit= (or ?cursor=) the response is a page:
+    {'materials', 'limit', 'next_cursor'} - pass next_cursor as ?cursor= for the next one.
+    """
+    match = fts_match_query(request.args.get('search', ''))
     category = request.args.get('category', '').strip()
-    low_stock = request.args.get('low_stock', '').lower() == 'true'
+    try:
+        status_condition, status_params = stock_status_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     conn = get_db_connection()
-    query = 'SELECT * FROM materials WHERE 1=1'
+    source = 'FROM materials WHERE 1=1'
     params = []
     
-    if search:
-        query += ' AND (LOWER(name) LIKE ? OR LOWER(notes) LIKE ?)'
-        params.extend([f'%{search}%', f'%{search}%'])
+    if match:
+        # Full-text search, best matches first (a hit in the name outweighs notes)
+        source = '''
+            FROM materials_fts
+            JOIN materials ON materials.id = materials_fts.rowid
+            WHERE materials_fts MATCH ?
+        '''
+        params.append(match)
     
     if category:
-        query += ' AND category = ?'
+        source += ' AND category = ?'
         params.append(category)
     
-    if low_stock:
-        query += ' AND quantity <= min_threshold'
-    
-    query += ' ORDER BY category, name'
+    if status_condition:
+        source += ' AND ' + status_condition
+        params.extend(status_params)
     
-    materials = conn.execute(query, params).fetchall()
+    try:
+        materials, page = fetch_list(conn, 'materials', source, params, request.args,
+                                     MATERIAL_COLUMNS, MATERIAL_SORTS, 'category',
+                                     rank='bm25(materials_fts, 10.0, 1.0)' if match else None)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
     conn.close()
     
-    return jsonify([dict(row) for row in materials])
+    if page is None:
+        return jsonify(materials)
+    return jsonify({'materials': materials, **page})
 
 @app.route('/api/materials/<int:material_id>', methods=['GET'])
 @login_required
@@ -689,21 +2523,21 @@ def add_material():
     if not data.get('name') or not data.get('category'):
         return jsonify({'error': 'Name and category are required'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.execute('''
-        INSERT INTO materials (name, category, quantity, min_threshold, max_threshold, notes)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        data['name'],
-        data['category'],
-        data.get('quantity', 0),
-        data.get('min_threshold', 5),
-        data.get('max_threshold', 50),
-        data.get('notes', '')
-    ))
-    conn.commit()
-    material_id = cursor.lastrowid
-    conn.close()
+    def insert_material(conn):
+        cursor = conn.execute('''
+            INSERT INTO materials (name, category, quantity, min_threshold, max_threshold, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            data['name'],
+            data['category'],
+            data.get('quantity', 0),
+            data.get('min_threshold', 5),
+            data.get('max_threshold', 50),
+            data.get('notes', '')
+        ))
+        return cursor.lastrowid
+    
+    material_id = run_write(insert_material, reason='create')
     
     return jsonify({'id': material_id, 'message': 'Material added successfully'}), 201
 
@@ -713,13 +2547,7 @@ def update_material(material_id):
     """Update existing material"""
     data = request.get_json()
     
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE materials 
-        SET name = ?, category = ?, quantity = ?, min_threshold = ?, 
-            max_threshold = ?, notes = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (
+    params = (
         data['name'],
         data['category'],
         data['quantity'],
@@ -727,9 +2555,13 @@ def update_material(material_id):
         data.get('max_threshold', 50),
         data.get('notes', ''),
         material_id
-    ))
-    conn.commit()
-    conn.close()
+    )
+    run_write(lambda conn: conn.execute('''
+        UPDATE materials 
+        SET name = ?, category = ?, quantity = ?, min_threshold = ?, 
+            max_threshold = ?, notes = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', params), reason='edit')
     
     return jsonify({'message': 'Material updated successfully'})
 
@@ -740,40 +2572,95 @@ def update_quantity(material_id):
     data = request.get_json()
     change = data.get('change', 0)
     
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE materials 
-        SET quantity = MAX(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (change, material_id))
-    conn.commit()
+    def adjust(conn):
+        conn.execute('''
+            UPDATE materials 
+            SET quantity = MAX(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (change, material_id))
+        
+        # Get updated material
+        return conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
     
-    # Get updated material
-    material = conn.execute('SELECT * FROM materials WHERE id = ?', (material_id,)).fetchone()
-    conn.close()
+    material = run_write(adjust, reason='adjust')
     
     return jsonify(dict(material))
 
+app.config['QUANTITY_BATCH_MAX'] = 500  # deltas accepted by one /quantities call
+
+def parse_quantity_changes(data):
+    """{id: summed change} from [{id, change}, ...] - raises ValueError on bad input"""
+    changes = data.get('changes') if isinstance(data, dict) else data
+    if not isinstance(changes, list) or not changes:
+        raise ValueError('changes must be a non-empty list of {id, change}')
+    if len(changes) > app.config['QUANTITY_BATCH_MAX']:
+        raise ValueError(f"At most {app.config['QUANTITY_BATCH_MAX']} changes per call")
+    
+    totals = {}
+    for item in changes:
+        item_id = item.get('id') if isinstance(item, dict) else None
+        change = item.get('change') if isinstance(item, dict) else None
+        if type(item_id) is not int or type(change) is not int:
+            raise ValueError('Each change needs an integer id and change')
+        totals[item_id] = totals.get(item_id, 0) + change
+    return totals
+
+def apply_quantity_changes(table, totals):
+    """Apply summed quantity deltas to table in one write job; returns
+    (changed rows, ids that don't exist). Ids whose changes cancel out are
+    neither - the client has nothing to re-render for them."""
+    ids = list(totals)
+    placeholders = ', '.join('?' * len(ids))
+    
+    def adjust(conn):
+        conn.executemany(f'''
+            UPDATE {table}
+            SET quantity = MAX(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', [(change, item_id) for item_id, change in totals.items() if change])
+        return conn.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', ids).fetchall()
+    
+    rows = [dict(row) for row in run_write(adjust, reason='adjust')]
+    found = {row['id'] for row in rows}
+    changed = [row for row in rows if totals[row['id']]]
+    return changed, [item_id for item_id in ids if item_id not in found]
+
+@app.route('/api/materials/quantities', methods=['PATCH'])
+@login_required
+def update_quantities():
+    """Apply several quantity changes at once, atomically.
+
+    Body: {"changes": [{"id": 1, "change": 3}, {"id": 2, "change": -1}]} -
+    changes for the same id are added up. Returns the rows that changed (ids
+    whose changes cancel out are left out) and the ids that were not found.
+    """
+    try:
+        totals = parse_quantity_changes(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    materials, missing = apply_quantity_changes('materials', totals)
+    
+    return jsonify({'materials': materials, 'missing': missing})
+
 @app.route('/api/materials/<int:material_id>', methods=['DELETE'])
 @login_required
 def delete_material(material_id):
     """Delete material"""
-    conn = get_db_connection()
-    conn.execute('DELETE FROM materials WHERE id = ?', (material_id,))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: conn.execute('DELETE FROM materials WHERE id = ?', (material_id,)), reason='delete')
     
     return jsonify({'message': 'Material deleted successfully'})
 
 @app.route('/api/categories', methods=['GET'])
 @login_required
+@versioned('materials')
 def get_categories():
     """Get all unique categories"""
-    conn = get_db_connection()
-    categories = conn.execute('SELECT DISTINCT category FROM materials ORDER BY category').fetchall()
-    conn.close()
+    categories = cached_lookup(('materials',), 'categories', lambda conn: [
+        row['category'] for row in conn.execute('SELECT DISTINCT category FROM materials ORDER BY category')
+    ])
     
-    return jsonify([row['category'] for row in categories])
+    return jsonify(categories)
 
 @app.route('/api/import', methods=['POST'])
 @login_required
@@ -808,9 +2695,7 @@ def import_excel():
         if not name_col:
             return jsonify({'error': 'Column for material name not found'}), 400
         
-        conn = get_db_connection()
-        imported = 0
-        
+        rows = []
         for _, row in df.iterrows():
             name = str(row[name_col]).strip()
             if not name or name.lower() in ['nan', 'none', '']:
@@ -818,30 +2703,32 @@ def import_excel():
             
             quantity = int(row[quantity_col]) if quantity_col and pd.notna(row[quantity_col]) else 0
             category = str(row[category_col]).strip() if category_col and pd.notna(row[category_col]) else 'Други'
-            
-            # Check if material already exists
-            existing = conn.execute('SELECT id FROM materials WHERE name = ?', (name,)).fetchone()
-            
-            if existing:
-                # Update existing
-                conn.execute('''
-                    UPDATE materials 
-                    SET quantity = ?, category = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (quantity, category, existing['id']))
-            else:
-                # Insert new
-                conn.execute('''
-                    INSERT INTO materials (name, category, quantity, min_threshold)
-                    VALUES (?, ?, ?, 5)
-                ''', (name, category, quantity))
-            
-            imported += 1
+            rows.append((name, category, quantity))
         
-        conn.commit()
-        conn.close()
+        def import_rows(conn):
+            for name, category, quantity in rows:
+                # Check if material already exists
+                existing = conn.execute('SELECT id FROM materials WHERE name = ?', (name,)).fetchone()
+                
+                if existing:
+                    # Update existing
+                    conn.execute('''
+                        UPDATE materials 
+                        SET quantity = ?, category = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (quantity, category, existing['id']))
+                else:
+                    # Insert new
+                    conn.execute('''
+                        INSERT INTO materials (name, category, quantity, min_threshold)
+                        VALUES (?, ?, ?, 5)
+                    ''', (name, category, quantity))
+        
+        import_id = uuid.uuid4().hex[:12]
+        run_write(import_rows, reason='import', source=f'import:{import_id}')
+        imported = len(rows)
         
-        return jsonify({'message': f'Successfully imported {imported} materials'})
+        return jsonify({'message': f'Successfully imported {imported} materials', 'import_id': import_id})
     
     except Exception as e:
         return jsonify({'error': f'Error importing file: {str(e)}'}), 500
@@ -858,7 +2745,7 @@ def export_excel():
         materials = conn.execute('''
             SELECT name, category, quantity, min_threshold, notes
             FROM materials 
-            WHERE quantity <= min_threshold
+            WHERE stock_status IN ('out', 'low')
             ORDER BY category, name
         ''').fetchall()
         filename = f'low_stock_materials_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
@@ -898,67 +2785,121 @@ def export_excel():
         download_name=filename
     )
 
+def read_counters(conn, scope, prefix=False):
+    """bucket -> count for a counters scope (summed over every scope starting
+    with it when prefix is set, e.g. 'books:' for all book types)"""
+    if prefix:
+        condition, params = 'scope >= ? AND scope < ?', (scope, scope + '\U0010ffff')
+    else:
+        condition, params = 'scope = ?', (scope,)
+    rows = conn.execute(f'''
+        SELECT bucket, SUM(count) as count FROM inventory_counters
+        WHERE {condition} GROUP BY bucket
+    ''', params).fetchall()
+    return {row['bucket']: row['count'] for row in rows}
+
+def materials_stats(conn):
+    """Material counts per stock status (adequate includes overstock)"""
+    counts = read_counters(conn, 'materials')
+    return {
+        'total': sum(counts.values()),
+        'out_of_stock': counts.get('out', 0),
+        'low_stock': counts.get('low', 0),
+        'adequate': counts.get('adequate', 0) + counts.get('overstock', 0),
+        'overstock': counts.get('overstock', 0)
+    }
+
+def books_stats(conn, book_type=''):
+    """Book counts per stock status, for one type or all of them"""
+    counts = read_counters(conn, f'books:{book_type}', prefix=not book_type)
+    return {
+        'total': sum(counts.values()),
+        'out_of_stock': counts.get('out', 0),
+        'low_stock': counts.get('low', 0),
+        'adequate': counts.get('adequate', 0)
+    }
+
+def requests_stats(conn):
+    """Request counts per status"""
+    counts = read_counters(conn, 'material_requests')
+    return {
+        'pending': counts.get('pending', 0),
+        'approved': counts.get('approved', 0),
+        'rejected': counts.get('rejected', 0),
+        'total': sum(counts.values())
+    }
+
 @app.route('/api/stats', methods=['GET'])
 @login_required
 def get_stats():
-    """Get inventory statistics"""
+    """Get inventory statistics (from the trigger-maintained counters)"""
     conn = get_db_connection()
-    
-    total = conn.execute('SELECT COUNT(*) as count FROM materials').fetchone()['count']
-    out_of_stock = conn.execute('SELECT COUNT(*) as count FROM materials WHERE quantity = 0').fetchone()['count']
-    low_stock = conn.execute('SELECT COUNT(*) as count FROM materials WHERE quantity > 0 AND quantity <= min_threshold').fetchone()['count']
-    adequate = conn.execute('SELECT COUNT(*) as count FROM materials WHERE quantity > min_threshold').fetchone()['count']
-    
+    stats = materials_stats(conn)
     conn.close()
     
-    return jsonify({
-        'total': total,
-        'out_of_stock': out_of_stock,
-        'low_stock': low_stock,
-        'adequate': adequate
-    })
+    return jsonify(stats)
 
 # ==================== BOOKS ROUTES (УЧЕБНИЦИ) ====================
 
 @app.route('/api/books', methods=['GET'])
 @login_required
+@versioned('books')
 def get_books():
-    """Get all books with optional filtering"""
-    search = request.args.get('search', '').strip().lower()  # Convert to lowercase
+    """Get all books with optional filtering.
+
+    Takes the same status, sort/order (grade|name|quantity|updated_at), fields
+    and limit/cursor args as /api/materials; a page is {'books', 'limit', 'next_cursor'}.
+    """
+    match = fts_match_query(request.args.get('search', ''))
     grade = request.args.get('grade', '').strip()
     book_type = request.args.get('type', '').strip()
     publisher = request.args.get('publisher', '').strip()
-    low_stock = request.args.get('low_stock', '').lower() == 'true'
+    try:
+        status_condition, status_params = stock_status_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     conn = get_db_connection()
-    query = 'SELECT * FROM books WHERE 1=1'
+    source = 'FROM books WHERE 1=1'
     params = []
     
-    if search:
-        query += ' AND (LOWER(subject) LIKE ? OR LOWER(author) LIKE ? OR LOWER(notes) LIKE ?)'
-        params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
+    if match:
+        # Full-text search, best matches first (subject, then author, then notes)
+        source = '''
+            FROM books_fts
+            JOIN books ON books.id = books_fts.rowid
+            WHERE books_fts MATCH ?
+        '''
+        params.append(match)
     
     if grade:
-        query += ' AND grade = ?'
+        source += ' AND grade = ?'
         params.append(int(grade))
     
     if book_type:
-        query += ' AND type = ?'
+        source += ' AND type = ?'
         params.append(book_type)
     
     if publisher:
-        query += ' AND publisher = ?'
+        source += ' AND publisher = ?'
         params.append(publisher)
     
-    if low_stock:
-        query += ' AND quantity <= min_threshold'
+    if status_condition:
+        source += ' AND ' + status_condition
+        params.extend(status_params)
     
-    query += ' ORDER BY grade, subject'
-    
-    books = conn.execute(query, params).fetchall()
+    try:
+        books, page = fetch_list(conn, 'books', source, params, request.args,
+                                 BOOK_COLUMNS, BOOK_SORTS, 'grade',
+                                 rank='bm25(books_fts, 10.0, 5.0, 1.0)' if match else None)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
     conn.close()
     
-    return jsonify([dict(row) for row in books])
+    if page is None:
+        return jsonify(books)
+    return jsonify({'books': books, **page})
 
 @app.route('/api/books/<int:book_id>', methods=['GET'])
 @login_required
@@ -982,23 +2923,23 @@ def add_book():
     if not data.get('subject') or not data.get('grade') or not data.get('type'):
         return jsonify({'error': 'Subject, grade and type are required'}), 400
     
-    conn = get_db_connection()
-    cursor = conn.execute('''
-        INSERT INTO books (subject, grade, publisher, author, quantity, min_threshold, notes, type)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data['subject'],
-        data['grade'],
-        data.get('publisher', ''),
-        data.get('author', ''),
-        data.get('quantity', 0),
-        data.get('min_threshold', 5),
-        data.get('notes', ''),
-        data['type']
-    ))
-    conn.commit()
-    book_id = cursor.lastrowid
-    conn.close()
+    def insert_book(conn):
+        cursor = conn.execute('''
+            INSERT INTO books (subject, grade, publisher, author, quantity, min_threshold, notes, type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            data['subject'],
+            data['grade'],
+            data.get('publisher', ''),
+            data.get('author', ''),
+            data.get('quantity', 0),
+            data.get('min_threshold', 5),
+            data.get('notes', ''),
+            data['type']
+        ))
+        return cursor.lastrowid
+    
+    book_id = run_write(insert_book, reason='create')
     
     return jsonify({'id': book_id, 'message': 'Book added successfully'}), 201
 
@@ -1008,14 +2949,7 @@ def update_book(book_id):
     """Update existing book"""
     data = request.get_json()
     
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE books 
-        SET subject = ?, grade = ?, publisher = ?, author = ?, 
-            quantity = ?, min_threshold = ?, notes = ?, type = ?,
-            updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (
+    params = (
         data['subject'],
         data['grade'],
         data.get('publisher', ''),
@@ -1025,9 +2959,14 @@ def update_book(book_id):
         data.get('notes', ''),
         data['type'],
         book_id
-    ))
-    conn.commit()
-    conn.close()
+    )
+    run_write(lambda conn: conn.execute('''
+        UPDATE books 
+        SET subject = ?, grade = ?, publisher = ?, author = ?, 
+            quantity = ?, min_threshold = ?, notes = ?, type = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', params), reason='edit')
     
     return jsonify({'message': 'Book updated successfully'})
 
@@ -1038,50 +2977,64 @@ def update_book_quantity(book_id):
     data = request.get_json()
     change = data.get('change', 0)
     
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE books 
-        SET quantity = MAX(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (change, book_id))
-    conn.commit()
+    def adjust(conn):
+        conn.execute('''
+            UPDATE books 
+            SET quantity = MAX(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (change, book_id))
+        
+        # Get updated book
+        return conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
     
-    # Get updated book
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
+    book = run_write(adjust, reason='adjust')
     
     return jsonify(dict(book))
 
+@app.route('/api/books/quantities', methods=['PATCH'])
+@login_required
+def update_book_quantities():
+    """Apply several book quantity changes at once (same body as /api/materials/quantities)"""
+    try:
+        totals = parse_quantity_changes(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    books, missing = apply_quantity_changes('books', totals)
+    
+    return jsonify({'books': books, 'missing': missing})
+
 @app.route('/api/books/<int:book_id>', methods=['DELETE'])
 @login_required
 def delete_book(book_id):
     """Delete book"""
-    conn = get_db_connection()
-    conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: conn.execute('DELETE FROM books WHERE id = ?', (book_id,)), reason='delete')
     
     return jsonify({'message': 'Book deleted successfully'})
 
 @app.route('/api/books/grades', methods=['GET'])
 @login_required
+@versioned('books')
 def get_grades():
     """Get all unique grades"""
-    conn = get_db_connection()
-    grades = conn.execute('SELECT DISTINCT grade FROM books ORDER BY grade').fetchall()
-    conn.close()
+    grades = cached_lookup(('books',), 'grades', lambda conn: [
+        row['grade'] for row in conn.execute('SELECT DISTINCT grade FROM books ORDER BY grade')
+    ])
     
-    return jsonify([row['grade'] for row in grades])
+    return jsonify(grades)
 
 @app.route('/api/books/publishers', methods=['GET'])
 @login_required
+@versioned('books')
 def get_publishers():
     """Get all unique publishers"""
-    conn = get_db_connection()
-    publishers = conn.execute('SELECT DISTINCT publisher FROM books WHERE publisher != "" ORDER BY publisher').fetchall()
-    conn.close()
+    publishers = cached_lookup(('books',), 'publishers', lambda conn: [
+        row['publisher'] for row in conn.execute(
+            'SELECT DISTINCT publisher FROM books WHERE publisher != "" ORDER BY publisher'
+        )
+    ])
     
-    return jsonify([row['publisher'] for row in publishers])
+    return jsonify(publishers)
 
 @app.route('/api/books/import', methods=['POST'])
 @login_required
@@ -1119,9 +3072,7 @@ def import_books_excel():
         if not subject_col or not grade_col:
             return jsonify({'error': 'Required columns not found (subject, grade)'}), 400
         
-        conn = get_db_connection()
-        imported = 0
-        
+        rows = []
         for _, row in df.iterrows():
             subject = str(row[subject_col]).strip()
             if not subject or subject.lower() in ['nan', 'none', '']:
@@ -1136,31 +3087,33 @@ def import_books_excel():
             author = str(row[author_col]).strip() if author_col and pd.notna(row[author_col]) else ''
             quantity = int(row[quantity_col]) if quantity_col and pd.notna(row[quantity_col]) else 0
             book_type = str(row[type_col]).strip() if type_col and pd.notna(row[type_col]) else 'Учебник'
-            
-            # Check if book already exists
-            existing = conn.execute('''
-                SELECT id FROM books 
-                WHERE subject = ? AND grade = ? AND type = ?
-            ''', (subject, grade, book_type)).fetchone()
-            
-            if existing:
-                conn.execute('''
-                    UPDATE books 
-                    SET quantity = ?, publisher = ?, author = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (quantity, publisher, author, existing['id']))
-            else:
-                conn.execute('''
-                    INSERT INTO books (subject, grade, publisher, author, quantity, min_threshold, type)
-                    VALUES (?, ?, ?, ?, ?, 5, ?)
-                ''', (subject, grade, publisher, author, quantity, book_type))
-            
-            imported += 1
+            rows.append((subject, grade, publisher, author, quantity, book_type))
         
-        conn.commit()
-        conn.close()
+        def import_rows(conn):
+            for subject, grade, publisher, author, quantity, book_type in rows:
+                # Check if book already exists
+                existing = conn.execute('''
+                    SELECT id FROM books 
+                    WHERE subject = ? AND grade = ? AND type = ?
+                ''', (subject, grade, book_type)).fetchone()
+                
+                if existing:
+                    conn.execute('''
+                        UPDATE books 
+                        SET quantity = ?, publisher = ?, author = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    ''', (quantity, publisher, author, existing['id']))
+                else:
+                    conn.execute('''
+                        INSERT INTO books (subject, grade, publisher, author, quantity, min_threshold, type)
+                        VALUES (?, ?, ?, ?, ?, 5, ?)
+                    ''', (subject, grade, publisher, author, quantity, book_type))
+        
+        import_id = uuid.uuid4().hex[:12]
+        run_write(import_rows, reason='import', source=f'import:{import_id}')
+        imported = len(rows)
         
-        return jsonify({'message': f'Successfully imported {imported} books'})
+        return jsonify({'message': f'Successfully imported {imported} books', 'import_id': import_id})
     
     except Exception as e:
         return jsonify({'error': f'Error importing file: {str(e)}'}), 500
@@ -1178,7 +3131,7 @@ def export_books_excel():
     params = []
     
     if low_stock_only:
-        query += ' AND quantity <= min_threshold'
+        query += " AND stock_status IN ('out', 'low')"
     
     if book_type:
         query += ' AND type = ?'
@@ -1223,45 +3176,582 @@ def export_books_excel():
 @app.route('/api/books/stats', methods=['GET'])
 @login_required
 def get_books_stats():
-    """Get books statistics"""
+    """Get books statistics, optionally for one ?type= (from the counters)"""
     book_type = request.args.get('type', '').strip()
     
     conn = get_db_connection()
+    stats = books_stats(conn, book_type)
+    conn.close()
+    
+    return jsonify(stats)
+
+# ==================== BULK EDITS ====================
+
+app.config['BULK_MAX_ITEMS'] = 1000  # create + update + delete items in one bulk call
+
+# Writable columns per table: type, required on create, defaults on create
+BULK_SPECS = {
+    'materials': {
+        'fields': {'name': str, 'category': str, 'quantity': int, 'min_threshold': int,
+                   'max_threshold': int, 'notes': str},
+        'required': ('name', 'category'),
+        'defaults': {'quantity': 0, 'min_threshold': 5, 'max_threshold': 50, 'notes': ''},
+    },
+    'books': {
+        'fields': {'subject': str, 'grade': int, 'publisher': str, 'author': str, 'quantity': int,
+                   'min_threshold': int, 'notes': str, 'type': str},
+        'required': ('subject', 'grade', 'type'),
+        'defaults': {'publisher': '', 'author': '', 'quantity': 0, 'min_threshold': 5, 'notes': ''},
+    },
+}
+
+def validate_bulk_item(spec, item, creating):
+    """Checked column values for one create/update item - raises ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object')
+    
+    row = {}
+    for field, kind in spec['fields'].items():
+        value = item.get(field)
+        if value is None:
+            continue
+        if kind is int and (type(value) is not int or value < 0):
+            raise ValueError(f'{field} must be a non-negative integer')
+        if kind is str and not isinstance(value, str):
+            raise ValueError(f'{field} must be a string')
+        row[field] = value
+    
+    blank = [field for field in spec['required'] if field in row and not str(row[field]).strip()]
+    if creating:
+        blank += [field for field in spec['required'] if field not in row]
+    if blank:
+        raise ValueError(f"{', '.join(blank)} required")
+    
+    if creating:
+        return {**spec['defaults'], **row}
+    if type(item.get('id')) is not int:
+        raise ValueError('id must be an integer')
+    if not row:
+        raise ValueError('Nothing to update')
+    return {'id': item['id'], **row}
+
+def bulk_edit(table):
+    """Validate a {create, update, delete} body and apply it in one write job.
+
+    Every item is checked first; if any fails nothing is written and the
+    response lists the errors per item. Updates only touch the fields they
+    carry (COALESCE keeps the rest).
+    """
+    spec = BULK_SPECS[table]
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be {"create": [...], "update": [...], "delete": [ids]}'}), 400
+    
+    ops = {op: data.get(op) or [] for op in ('create', 'update', 'delete')}
+    if not all(isinstance(items, list) for items in ops.values()):
+        return jsonify({'error': 'create, update and delete must be lists'}), 400
+    total = sum(len(items) for items in ops.values())
+    if not total:
+        return jsonify({'error': 'Nothing to do'}), 400
+    if total > app.config['BULK_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BULK_MAX_ITEMS']} items per call"}), 400
+    
+    creates, updates, errors = [], [], []
+    for op, rows in (('create', creates), ('update', updates)):
+        for index, item in enumerate(ops[op]):
+            try:
+                rows.append(validate_bulk_item(spec, item, op == 'create'))
+            except ValueError as e:
+                errors.append({'op': op, 'index': index, 'error': str(e)})
+    for index, item_id in enumerate(ops['delete']):
+        if type(item_id) is not int:
+            errors.append({'op': 'delete', 'index': index, 'error': 'id must be an integer'})
+    if errors:
+        return jsonify({'error': 'Validation failed, nothing was saved', 'errors': errors}), 400
+    
+    fields = list(spec['fields'])
+    deletes = list(dict.fromkeys(ops['delete']))
+    touched = list(dict.fromkeys([row['id'] for row in updates] + deletes))
+    
+    def apply(conn):
+        existing = set()
+        for start in range(0, len(touched), 500):
+            chunk = touched[start:start + 500]
+            existing.update(row[0] for row in conn.execute(
+                f"SELECT id FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        
+        created = []
+        if creates:
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                [tuple(row[field] for field in fields) for row in creates]
+            )
+            # AUTOINCREMENT and a single writer: the new rows got the last len(creates) ids
+            last = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()[0]
+            created = list(range(last - len(creates) + 1, last + 1))
+        
+        if updates:
+            conn.executemany(f'''
+                UPDATE {table}
+                SET {', '.join(f'{field} = COALESCE(?, {field})' for field in fields)},
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [tuple(row.get(field) for field in fields) + (row['id'],) for row in updates])
+        
+        if deletes:
+            conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(item_id,) for item_id in deletes])
+        
+        return created, existing
+    
+    created, existing = run_write(apply, reason='bulk')
+    
+    return jsonify({
+        'created': created,
+        'updated': list(dict.fromkeys(row['id'] for row in updates if row['id'] in existing)),
+        'deleted': [item_id for item_id in deletes if item_id in existing],
+        'missing': [item_id for item_id in touched if item_id not in existing]
+    })
+
+@app.route('/api/materials/bulk', methods=['POST'])
+@login_required
+def bulk_materials():
+    """Create, update and delete many materials in one transaction.
+
+    Body: {"create": [{name, category, ...}], "update": [{id, ...changed fields}],
+    "delete": [ids]}. Returns {created: [new ids], updated, deleted, missing}.
+    """
+    return bulk_edit('materials')
+
+@app.route('/api/books/bulk', methods=['POST'])
+@login_required
+def bulk_books():
+    """Create, update and delete many books in one transaction (see /api/materials/bulk)"""
+    return bulk_edit('books')
+
+# ==================== STOCK LEDGER ====================
+
+def take_stock_snapshot(conn):
+    """Writer job step: checkpoint every non-zero quantity at the current ledger
+    position. Skipped (returns None) when nothing moved since the last one."""
+    last = conn.execute('SELECT COALESCE(MAX(id), 0) FROM stock_movements').fetchone()[0]
+    previous = conn.execute('SELECT COALESCE(MAX(last_movement_id), 0) FROM stock_snapshots').fetchone()[0]
+    if last == previous:
+        return None
+    
+    snapshot_id = conn.execute('INSERT INTO stock_snapshots (last_movement_id) VALUES (?)', (last,)).lastrowid
+    for table in STOCK_TABLES:
+        conn.execute(f'''
+            INSERT INTO stock_snapshot_items (snapshot_id, item_type, item_id, quantity)
+            SELECT ?, '{table}', id, quantity FROM {table} WHERE quantity != 0
+        ''', (snapshot_id,))
+    return snapshot_id
+
+def thin_stock_snapshots(conn, cutoff):
+    """Writer job step: keep only the last snapshot of each day before cutoff"""
+    ids = [row[0] for row in conn.execute('''
+        SELECT id FROM stock_snapshots
+        WHERE taken_at < ? AND id NOT IN (
+            SELECT MAX(id) FROM stock_snapshots WHERE taken_at < ? GROUP BY date(taken_at)
+        )
+    ''', (cutoff, cutoff))]
+    conn.executemany('DELETE FROM stock_snapshot_items WHERE snapshot_id = ?', [(i,) for i in ids])
+    conn.executemany('DELETE FROM stock_snapshots WHERE id = ?', [(i,) for i in ids])
+    return len(ids)
+
+def snapshot_stock():
+    """Maintenance: checkpoint stock levels so point-in-time queries only replay
+    the movements since the nearest snapshot"""
+    cutoff = (datetime.utcnow() - timedelta(days=app.config['STOCK_SNAPSHOT_DAILY_AFTER_DAYS'])).strftime('%Y-%m-%d %H:%M:%S')
+    snapshot_id, thinned = db_writer.run(lambda conn: (take_stock_snapshot(conn), thin_stock_snapshots(conn, cutoff)))
+    if snapshot_id:
+        security_logger.info(f"Stock snapshot {snapshot_id} taken ({thinned} old snapshots thinned)")
+    return snapshot_id
+
+maintenance.register('snapshot_stock', app.config['STOCK_SNAPSHOT_INTERVAL'], snapshot_stock)
+
+# Columns shown next to point-in-time quantities (current values - deleted items get None)
+STOCK_LABELS = {
+    'materials': 't.name, t.category',
+    'books': 't.subject, t.grade, t.type',
+}
+
+def stock_levels_at(conn, table, before):
+    """Non-zero quantities of every item in table just before the given time:
+    the nearest earlier snapshot plus the movements recorded after it"""
+    snapshot = conn.execute('''
+        SELECT id, last_movement_id FROM stock_snapshots
+        WHERE taken_at < ? ORDER BY taken_at DESC, id DESC LIMIT 1
+    ''', (before,)).fetchone()
+    snapshot_id, last_movement_id = (snapshot['id'], snapshot['last_movement_id']) if snapshot else (0, 0)
+    
+    rows = conn.execute(f'''
+        SELECT s.item_id AS id, {STOCK_LABELS[table]}, s.quantity
+        FROM (
+            SELECT item_id, SUM(quantity) AS quantity FROM (
+                SELECT item_id, quantity FROM stock_snapshot_items
+                WHERE snapshot_id = ? AND item_type = ?
+                UNION ALL
+                SELECT item_id, delta FROM stock_movements
+                WHERE id > ? AND created_at < ? AND item_type = ?
+            )
+            GROUP BY item_id HAVING SUM(quantity) != 0
+        ) s
+        LEFT JOIN {table} t ON t.id = s.item_id
+        ORDER BY s.item_id
+    ''', (snapshot_id, table, last_movement_id, before, table)).fetchall()
+    return [dict(row) for row in rows]
+
+def item_quantity_at(conn, table, item_id, before):
+    """Quantity of one item just before the given time - its latest earlier movement"""
+    row = conn.execute('''
+        SELECT quantity FROM stock_movements
+        WHERE item_type = ? AND item_id = ? AND created_at < ?
+        ORDER BY created_at DESC, id DESC LIMIT 1
+    ''', (table, item_id, before)).fetchone()
+    return row['quantity'] if row else 0
+
+def item_history(table, item_id):
+    """Movements of one item, newest first.
+
+    ?date_from= / ?date_to= limit the time range (date_to is exclusive, a plain
+    date includes that day), ?limit= caps the page and ?cursor=<next_cursor>
+    continues it.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 500)
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
+        conditions, params = ['item_type = ?', 'item_id = ?'], [table, item_id]
+        if date_from:
+            conditions.append('created_at >= ?')
+            params.append(parse_log_date(date_from))
+        if date_to:
+            conditions.append('created_at < ?')
+            params.append(parse_log_date(date_to, end_of_day=True))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, cursor or date'}), 400
+    if cursor is not None:
+        conditions.append('id < ?')
+        params.append(cursor)
+    
+    conn = get_db_connection()
+    rows = conn.execute(f'''
+        SELECT id, delta, quantity, reason, source, actor, created_at
+        FROM stock_movements
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+    conn.close()
+    
+    movements = [dict(row) for row in rows[:limit]]
+    next_cursor = movements[-1]['id'] if len(rows) > limit else None
+    return jsonify({'movements': movements, 'limit': limit, 'next_cursor': next_cursor})
+
+@app.route('/api/materials/<int:material_id>/history', methods=['GET'])
+@login_required
+def get_material_history(material_id):
+    """Stock movements of one material (see item_history for the parameters)"""
+    return item_history('materials', material_id)
+
+@app.route('/api/books/<int:book_id>/history', methods=['GET'])
+@login_required
+def get_book_history(book_id):
+    """Stock movements of one book (see item_history for the parameters)"""
+    return item_history('books', book_id)
+
+@app.route('/api/stock/at', methods=['GET'])
+@login_required
+def get_stock_at():
+    """Stock levels at a point in time.
+
+    ?at=2025-09-01 (end of that day) or ?at=2025-09-01T08:00:00 (just before
+    that moment), ?type=materials|books, optional ?id= for a single item.
+    """
+    table = request.args.get('type', 'materials')
+    if table not in STOCK_TABLES:
+        return jsonify({'error': 'type must be materials or books'}), 400
+    try:
+        before = parse_log_date(request.args['at'], end_of_day=True)
+        item_id = int(request.args['id']) if request.args.get('id') else None
+    except (KeyError, ValueError):
+        return jsonify({'error': 'at must be a date or datetime (YYYY-MM-DD[THH:MM:SS])'}), 400
+    
+    conn = get_db_connection()
+    if item_id is not None:
+        result = {'id': item_id, 'quantity': item_quantity_at(conn, table, item_id, before)}
+    else:
+        result = {'items': stock_levels_at(conn, table, before)}
+    conn.close()
     
-    where_clause = f" WHERE type = '{book_type}'" if book_type else ""
+    return jsonify({'type': table, 'before': before, **result})
+
+# ==================== STOCK TRENDS ====================
+
+LEVEL_GRAINS = ('day', 'week', 'month')
+LEVEL_TREND_MAX_DAYS = 3650  # longest ?days= a trend request may ask for
+
+def level_periods(day):
+    """Start of the day, week (Monday) and month containing day ('YYYY-MM-DD')"""
+    date = datetime.strptime(day, '%Y-%m-%d')
+    week = date - timedelta(days=date.weekday())
+    return {'day': day, 'week': week.strftime('%Y-%m-%d'), 'month': day[:8] + '01'}
+
+def rollup_stock_levels_day(conn, day):
+    """Writer job: fold one finished day into the day, week and month rollups.
+
+    An item's close is its level at the end of the day (snapshot + movements);
+    low/high also cover the levels its movements went through that day and the
+    level it started the day with. Days must be rolled in order, since the
+    week/month rows take the close of the latest day.
+    """
+    periods = level_periods(day)
+    start = f'{day} 00:00:00'
+    end = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    movements = conn.execute('''
+        SELECT item_type, item_id, delta, quantity, reason FROM stock_movements
+        WHERE created_at >= ? AND created_at < ? ORDER BY id
+    ''', (start, end)).fetchall()
+    ranges = {}
+    for m in movements:
+        key = (m['item_type'], m['item_id'])
+        if key not in ranges:
+            # Level before the first move - unless the item only appeared that day
+            ranges[key] = [] if m['reason'] in ('opening', 'create') else [m['quantity'] - m['delta']]
+        ranges[key].append(m['quantity'])
+    
+    rows = []
+    closes = {}
+    for table in STOCK_TABLES:
+        closes[table] = {item['id']: item['quantity'] for item in stock_levels_at(conn, table, end)}
+        moved = [item_id for item_type, item_id in ranges if item_type == table]
+        for item_id in set(closes[table]).union(moved):
+            close = closes[table].get(item_id, 0)
+            levels = ranges.get((table, item_id), []) + [close]
+            for grain in LEVEL_GRAINS:
+                rows.append((table, item_id, grain, periods[grain], min(levels), max(levels), close))
+    conn.executemany('''
+        INSERT INTO item_levels (item_type, item_id, grain, period, low, high, close) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (item_type, item_id, grain, period) DO UPDATE SET
+            low = MIN(low, excluded.low), high = MAX(high, excluded.high), close = excluded.close
+    ''', rows)
+    
+    # Categories are taken from the current materials (deleted ones drop out)
+    totals = defaultdict(lambda: [0, 0])
+    for row in conn.execute('SELECT id, category FROM materials'):
+        quantity = closes['materials'].get(row['id'], 0)
+        totals[row['category']][0] += quantity
+        totals[row['category']][1] += quantity > 0
+    conn.executemany('''
+        INSERT INTO category_levels (category, grain, period, low, high, close, items) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (category, grain, period) DO UPDATE SET
+            low = MIN(low, excluded.low), high = MAX(high, excluded.high),
+            close = excluded.close, items = excluded.items
+    ''', [(category, grain, periods[grain], close, close, close, items)
+          for category, (close, items) in totals.items() for grain in LEVEL_GRAINS])
+    
+    conn.execute('INSERT INTO stock_level_days (day) VALUES (?)', (day,))
+    return len(rows) // len(LEVEL_GRAINS)
+
+def downsample_stock_levels(conn, today):
+    """Writer job: drop daily rows past STOCK_LEVEL_DAILY_DAYS and weekly rows past
+    STOCK_LEVEL_WEEKLY_DAYS - their weeks/months are already rolled up"""
+    removed = 0
+    for grain, days in (('day', app.config['STOCK_LEVEL_DAILY_DAYS']), ('week', app.config['STOCK_LEVEL_WEEKLY_DAYS'])):
+        cutoff = (today - timedelta(days=days)).strftime('%Y-%m-%d')
+        for table in ('item_levels', 'category_levels'):
+            removed += conn.execute(f'DELETE FROM {table} WHERE grain = ? AND period < ?', (grain, cutoff)).rowcount
+    return removed
+
+def rollup_stock_levels():
+    """Maintenance: roll up every finished day not rolled yet (from the first
+    ledger day), one write job per day, then downsample old rows"""
+    today = datetime.utcnow().date()
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT (SELECT MAX(day) FROM stock_level_days) AS last_day,
+               (SELECT date(MIN(created_at)) FROM stock_movements) AS first_day
+    ''').fetchone()
+    conn.close()
     
-    total = conn.execute(f'SELECT COUNT(*) as count FROM books{where_clause}').fetchone()['count']
-    out_of_stock = conn.execute(f'SELECT COUNT(*) as count FROM books{where_clause} {"AND" if book_type else "WHERE"} quantity = 0').fetchone()['count']
-    low_stock = conn.execute(f'SELECT COUNT(*) as count FROM books{where_clause} {"AND" if book_type else "WHERE"} quantity > 0 AND quantity <= min_threshold').fetchone()['count']
-    adequate = conn.execute(f'SELECT COUNT(*) as count FROM books{where_clause} {"AND" if book_type else "WHERE"} quantity > min_threshold').fetchone()['count']
+    if row['last_day']:
+        day = datetime.strptime(row['last_day'], '%Y-%m-%d').date() + timedelta(days=1)
+    elif row['first_day']:
+        day = datetime.strptime(row['first_day'], '%Y-%m-%d').date()
+    else:
+        return 0
+    
+    rolled = 0
+    while day < today:
+        db_writer.run(lambda conn, day=day.isoformat(): rollup_stock_levels_day(conn, day))
+        day += timedelta(days=1)
+        rolled += 1
+    
+    if rolled:
+        db_writer.run(lambda conn: downsample_stock_levels(conn, today))
+        security_logger.info(f"Rolled up stock levels for {rolled} day(s)")
+    return rolled
+
+maintenance.register('rollup_stock_levels', app.config['MAINTENANCE_INTERVAL'], rollup_stock_levels)
+
+def level_trend_args():
+    """(grain, first period) from ?grain=day|week|month and ?days= (default: the
+    grain's retention, i.e. the whole series) - raises ValueError"""
+    grain = request.args.get('grain', 'day')
+    if grain not in LEVEL_GRAINS:
+        raise ValueError('grain must be day, week or month')
+    default_days = {'day': app.config['STOCK_LEVEL_DAILY_DAYS'], 'week': app.config['STOCK_LEVEL_WEEKLY_DAYS'],
+                    'month': LEVEL_TREND_MAX_DAYS}
+    try:
+        days = int(request.args.get('days', default_days[grain]))
+    except ValueError:
+        raise ValueError('days must be an integer')
+    if not 1 <= days <= LEVEL_TREND_MAX_DAYS:
+        raise ValueError(f'days must be between 1 and {LEVEL_TREND_MAX_DAYS}')
+    start = level_periods((datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d'))[grain]
+    return grain, start
+
+def item_trend(table, item_id):
+    """Stock level series of one item: {grain, points: [{period, low, high, close}], current}"""
+    try:
+        grain, start = level_trend_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    conn = get_db_connection()
+    item = conn.execute(f'SELECT quantity FROM {table} WHERE id = ?', (item_id,)).fetchone()
+    points = conn.execute('''
+        SELECT period, low, high, close FROM item_levels
+        WHERE item_type = ? AND item_id = ? AND grain = ? AND period >= ?
+        ORDER BY period
+    ''', (table, item_id, grain, start)).fetchall()
     conn.close()
     
+    if item is None and not points:
+        return jsonify({'error': 'Item not found'}), 404
+    
     return jsonify({
-        'total': total,
-        'out_of_stock': out_of_stock,
-        'low_stock': low_stock,
-        'adequate': adequate
+        'grain': grain,
+        'points': [dict(point) for point in points],
+        'current': item['quantity'] if item else 0
     })
 
-# ==================== ADMIN ENDPOINTS ====================
+@app.route('/api/materials/<int:material_id>/trend', methods=['GET'])
+@login_required
+def get_material_trend(material_id):
+    """Stock level trend of one material (?grain=day|week|month, ?days=)"""
+    return item_trend('materials', material_id)
 
-@app.route('/api/admin/categories', methods=['GET'])
-@admin_required
-def get_categories_admin():
-    """Get all categories with material count (admin only)"""
+@app.route('/api/books/<int:book_id>/trend', methods=['GET'])
+@login_required
+def get_book_trend(book_id):
+    """Stock level trend of one book (?grain=day|week|month, ?days=)"""
+    return item_trend('books', book_id)
+
+@app.route('/api/categories/<path:category>/trend', methods=['GET'])
+@login_required
+def get_category_trend(category):
+    """Total stock of one material category over time:
+    {grain, points: [{period, low, high, close, items}], current}"""
+    try:
+        grain, start = level_trend_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     conn = get_db_connection()
+    points = conn.execute('''
+        SELECT period, low, high, close, items FROM category_levels
+        WHERE category = ? AND grain = ? AND period >= ?
+        ORDER BY period
+    ''', (category, grain, start)).fetchall()
+    current = conn.execute('SELECT SUM(quantity) FROM materials WHERE category = ?', (category,)).fetchone()[0]
+    conn.close()
+    
+    if current is None and not points:
+        return jsonify({'error': 'Category not found'}), 404
     
-    categories = conn.execute('''
-        SELECT category as name, COUNT(*) as count 
-        FROM materials 
-        GROUP BY category 
-        ORDER BY category
+    return jsonify({'grain': grain, 'points': [dict(point) for point in points], 'current': current or 0})
+
+# ==================== REORDER ====================
+
+def reorder_items(conn):
+    """Queued materials with the suggested order: enough to get back to
+    max_threshold (min_threshold when there is none) after the pending requests"""
+    rows = conn.execute('''
+        SELECT m.id, m.name, m.category, m.quantity, m.min_threshold, m.max_threshold, q.pending,
+               MAX(0, COALESCE(m.max_threshold, m.min_threshold) - m.quantity + q.pending) AS suggested,
+               q.queued_at
+        FROM reorder_queue q
+        JOIN materials m ON m.id = q.material_id
+        ORDER BY m.category, m.name
     ''').fetchall()
+    return [dict(row) for row in rows]
+
+@app.route('/api/reorder', methods=['GET'])
+@login_required
+@versioned('materials', 'material_requests')
+def get_reorder_list():
+    """Materials to reorder with suggested quantities (read from reorder_queue)"""
+    conn = get_db_connection()
+    items = reorder_items(conn)
+    conn.close()
     
+    return jsonify(items)
+
+@app.route('/api/reorder/export', methods=['GET'])
+@login_required
+def export_purchase_order():
+    """Export the reorder list as a purchase order Excel file"""
+    conn = get_db_connection()
+    items = reorder_items(conn)
     conn.close()
     
-    return jsonify([dict(row) for row in categories])
+    columns = ['Име на материал', 'Категория', 'Наличност', 'Минимален праг', 'Максимален праг',
+               'Чакащи заявки', 'За поръчка']
+    df = pd.DataFrame([
+        (item['name'], item['category'], item['quantity'], item['min_threshold'], item['max_threshold'],
+         item['pending'], item['suggested'])
+        for item in items
+    ], columns=columns)
+    
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Поръчка')
+        
+        # Auto-adjust column widths
+        worksheet = writer.sheets['Поръчка']
+        for idx, col in enumerate(df.columns):
+            max_length = max([len(col)] + [len(str(value)) for value in df[col]]) + 2
+            worksheet.column_dimensions[chr(65 + idx)].width = min(max_length, 50)
+    
+    output.seek(0)
+    
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'purchase_order_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+    )
+
+# ==================== ADMIN ENDPOINTS ====================
+
+@app.route('/api/admin/categories', methods=['GET'])
+@admin_required
+def get_categories_admin():
+    """Get all categories with material count (admin only)"""
+    categories = cached_lookup(('materials',), 'category_counts', lambda conn: [
+        dict(row) for row in conn.execute('''
+            SELECT category as name, COUNT(*) as count 
+            FROM materials 
+            GROUP BY category 
+            ORDER BY category
+        ''')
+    ])
+    
+    return jsonify(categories)
 
 @app.route('/api/admin/categories', methods=['POST'])
 @admin_required
@@ -1309,11 +3799,12 @@ def update_category():
         conn.close()
         return jsonify({'error': 'Категорията вече съществува'}), 400
     
-    # Update all materials with this category
-    conn.execute('UPDATE materials SET category = ? WHERE category = ?', (new_name, old_name))
-    conn.commit()
     conn.close()
     
+    # Update all materials with this category
+    run_write(lambda conn: conn.execute(
+        'UPDATE materials SET category = ? WHERE category = ?', (new_name, old_name)))
+    
     return jsonify({'message': 'Category updated successfully'})
 
 @app.route('/api/admin/categories', methods=['DELETE'])
@@ -1343,18 +3834,16 @@ def delete_category():
 @admin_required
 def get_publishers_admin():
     """Get all publishers with book count (admin only)"""
-    conn = get_db_connection()
-    
-    publishers = conn.execute('''
-        SELECT publisher as name, COUNT(*) as count 
-        FROM books 
-        GROUP BY publisher 
-        ORDER BY publisher
-    ''').fetchall()
-    
-    conn.close()
-    
-    return jsonify([dict(row) for row in publishers])
+    publishers = cached_lookup(('books',), 'publisher_counts', lambda conn: [
+        dict(row) for row in conn.execute('''
+            SELECT publisher as name, COUNT(*) as count 
+            FROM books 
+            GROUP BY publisher 
+            ORDER BY publisher
+        ''')
+    ])
+    
+    return jsonify(publishers)
 
 @app.route('/api/admin/publishers', methods=['POST'])
 @admin_required
@@ -1402,11 +3891,12 @@ def update_publisher():
         conn.close()
         return jsonify({'error': 'Издателството вече съществува'}), 400
     
-    # Update all books with this publisher
-    conn.execute('UPDATE books SET publisher = ? WHERE publisher = ?', (new_name, old_name))
-    conn.commit()
     conn.close()
     
+    # Update all books with this publisher
+    run_write(lambda conn: conn.execute(
+        'UPDATE books SET publisher = ? WHERE publisher = ?', (new_name, old_name)))
+    
     return jsonify({'message': 'Publisher updated successfully'})
 
 @app.route('/api/admin/publishers', methods=['DELETE'])
@@ -1436,6 +3926,7 @@ def delete_publisher():
 
 @app.route('/api/requests', methods=['GET'])
 @login_required
+@versioned('material_requests', 'materials', 'users')
 def get_requests():
     """Get material requests (filtered by role)"""
     conn = get_db_connection()
@@ -1509,15 +4000,19 @@ def create_request():
         conn.close()
         return jsonify({'error': 'Material not found'}), 404
     
+    conn.close()
+    
     # Create request
-    conn.execute('''
-        INSERT INTO material_requests (user_id, material_id, requested_quantity, notes, status)
-        VALUES (?, ?, ?, ?, 'pending')
-    ''', (session['user_id'], material_id, requested_quantity, notes))
+    user_id = session['user_id']
     
-    conn.commit()
-    request_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
-    conn.close()
+    def insert_request(conn):
+        cursor = conn.execute('''
+            INSERT INTO material_requests (user_id, material_id, requested_quantity, notes, status)
+            VALUES (?, ?, ?, ?, 'pending')
+        ''', (user_id, material_id, requested_quantity, notes))
+        return cursor.lastrowid
+    
+    request_id = run_write(insert_request)
     
     return jsonify({
         'message': 'Request created successfully',
@@ -1535,51 +4030,50 @@ def process_request(request_id):
     if status not in ['approved', 'rejected']:
         return jsonify({'error': 'Invalid status'}), 400
     
-    conn = get_db_connection()
-    
-    # Get request details
-    req = conn.execute('''
-        SELECT r.*, m.quantity as current_quantity
-        FROM material_requests r
-        JOIN materials m ON r.material_id = m.id
-        WHERE r.id = ?
-    ''', (request_id,)).fetchone()
-    
-    if not req:
-        conn.close()
-        return jsonify({'error': 'Request not found'}), 404
-    
-    if req['status'] != 'pending':
-        conn.close()
-        return jsonify({'error': 'Request already processed'}), 400
+    admin_id = session['user_id']
     
-    # If approved, check if enough quantity and deduct
-    if status == 'approved':
-        if req['current_quantity'] < req['requested_quantity']:
-            conn.close()
-            return jsonify({'error': 'Insufficient quantity available'}), 400
+    # Check and deduct in the same write job so two approvals can't oversell
+    def process(conn):
+        # Get request details
+        req = conn.execute('''
+            SELECT r.*, m.quantity as current_quantity
+            FROM material_requests r
+            JOIN materials m ON r.material_id = m.id
+            WHERE r.id = ?
+        ''', (request_id,)).fetchone()
+        
+        if not req:
+            return {'error': 'Request not found'}, 404
+        
+        if req['status'] != 'pending':
+            return {'error': 'Request already processed'}, 400
+        
+        # If approved, check if enough quantity and deduct
+        if status == 'approved':
+            if req['current_quantity'] < req['requested_quantity']:
+                return {'error': 'Insufficient quantity available'}, 400
+            
+            # Deduct quantity from materials
+            conn.execute('''
+                UPDATE materials 
+                SET quantity = quantity - ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (req['requested_quantity'], req['material_id']))
         
-        # Deduct quantity from materials
+        # Update request status
         conn.execute('''
-            UPDATE materials 
-            SET quantity = quantity - ?, updated_at = CURRENT_TIMESTAMP
+            UPDATE material_requests 
+            SET status = ?, 
+                admin_notes = ?, 
+                processed_by = ?, 
+                processed_at = CURRENT_TIMESTAMP
             WHERE id = ?
-        ''', (req['requested_quantity'], req['material_id']))
-    
-    # Update request status
-    conn.execute('''
-        UPDATE material_requests 
-        SET status = ?, 
-            admin_notes = ?, 
-            processed_by = ?, 
-            processed_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (status, admin_notes, session['user_id'], request_id))
-    
-    conn.commit()
-    conn.close()
+        ''', (status, admin_notes, admin_id, request_id))
+        
+        return {'message': f'Request {status} successfully'}, 200
     
-    return jsonify({'message': f'Request {status} successfully'})
+    result, status_code = run_write(process, reason='request', source=f'request:{request_id}')
+    return jsonify(result), status_code
 
 @app.route('/api/requests/<int:request_id>', methods=['PUT'])
 @login_required
@@ -1608,18 +4102,16 @@ def update_request(request_id):
     requested_quantity = data.get('requested_quantity')
     notes = data.get('notes', '').strip()
     
+    conn.close()
+    
     if not requested_quantity or requested_quantity < 1:
-        conn.close()
         return jsonify({'error': 'Invalid quantity'}), 400
     
-    conn.execute('''
+    run_write(lambda conn: conn.execute('''
         UPDATE material_requests 
         SET requested_quantity = ?, notes = ?
         WHERE id = ?
-    ''', (requested_quantity, notes if notes else None, request_id))
-    
-    conn.commit()
-    conn.close()
+    ''', (requested_quantity, notes if notes else None, request_id)))
     
     return jsonify({'message': 'Request updated successfully'})
 
@@ -1646,25 +4138,17 @@ def delete_request(request_id):
         conn.close()
         return jsonify({'error': 'Cannot delete processed request'}), 400
     
-    conn.execute('DELETE FROM material_requests WHERE id = ?', (request_id,))
-    conn.commit()
     conn.close()
+    run_write(lambda conn: conn.execute('DELETE FROM material_requests WHERE id = ?', (request_id,)))
     
     return jsonify({'message': 'Request deleted successfully'})
 
 @app.route('/api/requests/stats', methods=['GET'])
 @admin_required
 def get_requests_stats():
-    """Get requests statistics (admin only)"""
+    """Get requests statistics (admin only, from the counters)"""
     conn = get_db_connection()
-    
-    stats = {
-        'pending': conn.execute("SELECT COUNT(*) as count FROM material_requests WHERE status = 'pending'").fetchone()['count'],
-        'approved': conn.execute("SELECT COUNT(*) as count FROM material_requests WHERE status = 'approved'").fetchone()['count'],
-        'rejected': conn.execute("SELECT COUNT(*) as count FROM material_requests WHERE status = 'rejected'").fetchone()['count'],
-        'total': conn.execute("SELECT COUNT(*) as count FROM material_requests").fetchone()['count']
-    }
-    
+    stats = requests_stats(conn)
     conn.close()
     
     return jsonify(stats)
@@ -1696,8 +4180,131 @@ def get_user_request_history(user_id):
     
     return jsonify([dict(row) for row in history])
 
+# ==================== DASHBOARD ====================
+
+@app.route('/api/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    """Everything the landing page needs in one response.
+
+    All sections are read in a single transaction, so they come from the same
+    snapshot of the database. Admins also get the request counters for the
+    pending badge.
+    """
+    is_admin = session.get('role') == 'admin'
+    conn = get_db_connection()
+    conn.execute('BEGIN')  # one read snapshot (WAL) for every query below
+    try:
+        dashboard = {
+            'user': {
+                'id': session['user_id'],
+                'username': session['username'],
+                'full_name': session['full_name'],
+                'role': session['role'],
+                'company': session.get('company')
+            },
+            'stats': materials_stats(conn),
+            'categories': [row['category'] for row in conn.execute(
+                'SELECT DISTINCT category FROM materials ORDER BY category'
+            ).fetchall()]
+        }
+        if is_admin:
+            dashboard['requests_stats'] = requests_stats(conn)
+    finally:
+        conn.close()  # ends the read transaction
+    
+    return jsonify(dashboard)
+
+# ==================== BATCH ====================
+
+app.config['BATCH_MAX_REQUESTS'] = 20  # sub-requests allowed in one /api/batch call
+
+# Request headers passed on to sub-requests (the session cookie carries the login)
+BATCH_FORWARDED_HEADERS = ('Cookie', 'User-Agent', 'Accept-Language', 'X-Forwarded-For', 'X-Real-IP')
+
+# GET endpoints that answer with a file or a stream - refused before they run
+BATCH_EXCLUDED_ENDPOINTS = {'batch_requests', 'export_excel', 'export_books_excel',
+                            'export_security_logs', 'export_purchase_order'}
+
+def dispatch_subrequest(path):
+    """Run GET path through the app inside the current app context.
+
+    The nested request context reuses this app context, so the sub-request
+    shares g.db (one pooled connection for the whole batch). Auth decorators
+    run as usual against the forwarded session cookie. The path is matched
+    first, so unknown paths and non-JSON endpoints never reach their view.
+    Returns (status, body).
+    """
+    builder = EnvironBuilder(
+        path=path,
+        method='GET',
+        base_url=request.host_url,
+        headers={name: request.headers[name] for name in BATCH_FORWARDED_HEADERS if name in request.headers},
+        environ_base={'REMOTE_ADDR': request.remote_addr}
+    )
+    try:
+        with app.request_context(builder.get_environ()) as ctx:
+            try:
+                endpoint, _ = ctx.url_adapter.match()
+            except HTTPException as e:
+                return e.code, {'error': f'{e.code} {e.name.upper()}'}
+            if endpoint in BATCH_EXCLUDED_ENDPOINTS:
+                return 406, {'error': 'Only JSON endpoints can be batched'}
+            
+            response = app.make_response(app.full_dispatch_request())
+            try:
+                if response.is_json and not response.is_streamed:
+                    return response.status_code, response.get_json()
+                if response.status_code >= 400:
+                    return response.status_code, {'error': response.status}
+                return 406, {'error': 'Only JSON endpoints can be batched'}
+            finally:
+                response.close()
+    except Exception as e:
+        app.logger.exception(f"Batch sub-request {path} failed: {e}")
+        return 500, {'error': 'Internal server error'}
+    finally:
+        builder.close()
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch_requests():
+    """Run several API GET requests in one round trip.
+
+    Body: {"requests": [{"id": "users", "path": "/api/users"}, "/api/categories", ...]}
+    (a plain string is a path, used as its own id). Returns
+    {"responses": {id: {"status": ..., "body": ...}}}. Each sub-request is
+    authorized on its own, so one 403 doesn't fail the others.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be {"requests": [...]}'}), 400
+    items = data.get('requests')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    if len(items) > app.config['BATCH_MAX_REQUESTS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_REQUESTS']} requests per batch"}), 400
+    
+    responses = {}
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item_id, path = item, item
+        elif isinstance(item, dict):
+            item_id, path = item.get('id', index), item.get('path')
+        else:
+            item_id, path = index, None
+        
+        if not isinstance(path, str) or not path.startswith('/api/') or path.split('?')[0].rstrip('/') == '/api/batch':
+            status, body = 400, {'error': 'path must be an /api/ GET path (not /api/batch)'}
+        else:
+            status, body = dispatch_subrequest(path)
+        responses[str(item_id)] = {'status': status, 'body': body}
+    
+    return jsonify({'responses': responses})
+
 if __name__ == '__main__':
-    init_db()
+    with app.app_context():
+        init_db()
     print("🎓 Система за управление на училищни материали")
     print("=" * 50)
     print("Сървърът стартира на: http://127.0.0.1:5000")
@@ -27,6 +27,8 @@ async function loadBooks(type) {
     const lowStock = document.getElementById(lowStockId)?.checked || false;
     
     const params = new URLSearchParams();
+    // Only the columns the table renders
+    params.append('fields', 'id,subject,grade,publisher,author,quantity');
     params.append('type', type);
     if (search) params.append('search', search);
     if (grade) params.append('grade', grade);
@@ -58,8 +60,13 @@ function displayBooks(books, tbodyId) {
         return;
     }
     
-    tbody.innerHTML = books.map(b => `
-        <tr>
+    tbody.innerHTML = books.map(bookRow).join('');
+}
+
+// Table row for one book
+function bookRow(b) {
+    return `
+        <tr data-book-id="${b.id}">
             <td>${getBookStatusBadge(b.quantity, 5)}</td>
             <td><strong>${b.subject}</strong></td>
             <td><span class="badge bg-info">${b.grade} клас</span></td>
@@ -72,7 +79,7 @@ function displayBooks(books, tbodyId) {
                             ${b.quantity <= 0 ? 'disabled' : ''}>
                         <i class="bi bi-dash"></i>
                     </button>
-                    <strong class="mx-2">${b.quantity}</strong>
+                    <strong class="mx-2" data-book-qty="${b.id}">${b.quantity}</strong>
                     <button class="btn btn-sm btn-outline-success ms-2" 
                             onclick="adjustBookQuantity(${b.id}, 1)">
                         <i class="bi bi-plus"></i>
@@ -88,7 +95,7 @@ function displayBooks(books, tbodyId) {
                 </button>
             </td>
         </tr>
-    `).join('');
+    `;
 }
 
 // Load publishers for filter dropdowns
@@ -112,25 +119,49 @@ async function loadBooksPublishers() {
     }
 }
 
-// Adjust book quantity
-async function adjustBookQuantity(id, change) {
+// Adjust book quantity - taps are coalesced like adjustMaterialQuantity
+const pendingBookChanges = new Map();
+const flushBookChanges = debounce(saveBookChanges, 400);
+
+// Book type and low-stock checkbox of each books table
+const BOOK_TABLES = {
+    'books-tbody': ['Учебник', 'books-low-stock'],
+    'workbooks-tbody': ['Учебна тетрадка', 'workbooks-low-stock']
+};
+
+function adjustBookQuantity(id, change) {
+    const shown = document.querySelectorAll(`[data-book-qty="${id}"]`);
+    if (shown.length > 0) {
+        const current = parseInt(shown[0].textContent);
+        const quantity = Math.max(0, current + change);
+        change = quantity - current;
+        shown.forEach(qty => { qty.textContent = quantity; });
+    }
+    
+    pendingBookChanges.set(id, (pendingBookChanges.get(id) || 0) + change);
+    flushBookChanges();
+}
+
+async function saveBookChanges() {
+    const changes = [...pendingBookChanges].map(([id, change]) => ({ id, change }));
+    pendingBookChanges.clear();
+    if (changes.length === 0) return;
+    
     try {
-        const response = await fetch(`/api/books/${id}/quantity`, {
+        const response = await fetch('/api/books/quantities', {
             method: 'PATCH',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ change })
+            body: JSON.stringify({ changes })
         });
         
         if (response.ok) {
+            const result = await response.json();
+            result.books.forEach(updateBookRows);
             showToast('Количеството е обновено');
-            // Reload current section
-            if (currentSection === 'books-textbooks') {
-                loadBooks('Учебник');
-            } else if (currentSection === 'books-workbooks') {
-                loadBooks('Учебна тетрадка');
-            }
+            return;
         } else if (response.status === 401) {
             window.location.href = '/login';
+            return;
         } else {
             const error = await response.json();
             showToast(error.error || 'Грешка при обновяване', 'error');
@@ -139,6 +170,32 @@ async function adjustBookQuantity(id, change) {
         console.error('Error:', error);
         showToast('Грешка при свързване със сървъра', 'error');
     }
+    
+    // The optimistic numbers may be wrong now - reload current section
+    if (currentSection === 'books-textbooks') {
+        loadBooks('Учебник');
+    } else if (currentSection === 'books-workbooks') {
+        loadBooks('Учебна тетрадка');
+    }
+}
+
+// Redraw a book's rows from the server's copy (dropped from low-stock views it left)
+function updateBookRows(book) {
+    // Taps made while the request was in flight are still pending - keep showing them
+    const pending = pendingBookChanges.get(book.id) || 0;
+    book = { ...book, quantity: Math.max(0, book.quantity + pending) };
+    document.querySelectorAll(`tr[data-book-id="${book.id}"]`).forEach(row => {
+        const tbody = row.parentElement;
+        const [type, lowStockId] = BOOK_TABLES[tbody.id] || [];
+        if (document.getElementById(lowStockId)?.checked && book.stock_status === 'adequate') {
+            row.remove();
+            if (!tbody.querySelector('tr[data-book-id]')) {
+                loadBooks(type);  // shows the empty-table message
+            }
+        } else {
+            row.outerHTML = bookRow(book);
+        }
+    });
 }
 
 // Show Add Book Modal
@@ -19,31 +19,26 @@ async function loadMaterials(filterType = 'all') {
     const lowStock = document.getElementById('materials-low-stock')?.checked || false;
     
     const params = new URLSearchParams();
+    // Only the columns the tables render
+    params.append('fields', 'id,name,category,quantity,min_threshold');
     if (search) params.append('search', search);
     if (category) params.append('category', category);
     
-    // Apply filter based on section
+    // Apply filter based on section (filtered on the server)
     if (filterType === 'low') {
-        params.append('low_stock', 'true');
+        params.append('status', 'out,low');
     } else if (filterType === 'out') {
-        // Will filter for quantity = 0 in display
+        params.append('status', 'out');
     } else if (lowStock) {
-        params.append('low_stock', 'true');
+        params.append('status', 'out,low');
     }
     
     try {
         const response = await fetch(`/api/materials?${params}`);
         if (response.ok) {
             const materials = await response.json();
-            
-            // Filter for out of stock if needed
-            let filteredMaterials = materials;
-            if (filterType === 'out') {
-                filteredMaterials = materials.filter(m => m.quantity === 0);
-            }
-            
-            displayMaterials(filteredMaterials, filterType);
-            updateStatistics(materials);
+            displayMaterials(materials, filterType);
+            updateStatistics();
         } else if (response.status === 401) {
             window.location.href = '/login';
         } else {
@@ -56,11 +51,22 @@ async function loadMaterials(filterType = 'all') {
 }
 
 // Update statistics cards
-function updateStatistics(materials) {
-    const available = materials.filter(m => m.quantity > m.min_threshold).length;
-    const low = materials.filter(m => m.quantity > 0 && m.quantity <= m.min_threshold).length;
-    const out = materials.filter(m => m.quantity === 0).length;
-    const total = materials.length;
+async function updateStatistics() {
+    let stats = takePreloaded('stats');
+    if (!stats) {
+        try {
+            const response = await fetch('/api/stats');
+            if (!response.ok) return;
+            stats = await response.json();
+        } catch (error) {
+            console.error('Error loading stats:', error);
+            return;
+        }
+    }
+    const available = stats.adequate;
+    const low = stats.low_stock;
+    const out = stats.out_of_stock;
+    const total = stats.total;
     
     // Update main page stats
     document.getElementById('stat-available').textContent = available;
@@ -103,70 +109,73 @@ function displayMaterials(materials, filterType = 'all') {
         return;
     }
     
+    tbody.innerHTML = materials.map(m => materialRow(m, filterType)).join('');
+}
+
+// Table row for one material - the out/low sections have their own layout
+function materialRow(m, filterType = 'all') {
     // Different display for out of stock section
     if (filterType === 'out') {
-        tbody.innerHTML = materials.map(m => `
-            <tr class="table-danger">
-                <td>${getMaterialStatusBadge(m.quantity, m.min_threshold)}</td>
-                <td><strong>${m.name}</strong></td>
-                <td><span class="badge bg-secondary">${m.category}</span></td>
-                <td>
-                    <span class="badge bg-info">Минимум: ${m.min_threshold} бр</span>
-                </td>
-                <td>
-                    <button class="btn btn-sm btn-success" onclick="adjustMaterialQuantity(${m.id}, 10)">
-                        <i class="bi bi-plus-circle"></i> Добави 10
-                    </button>
-                    <button class="btn btn-sm btn-primary" onclick="showEditMaterialModal(${m.id})">
-                        <i class="bi bi-pencil"></i>
-                    </button>
-                </td>
-            </tr>
-        `).join('');
-        return;
+        return `
+        <tr class="table-danger" data-material-id="${m.id}">
+            <td>${getMaterialStatusBadge(m.quantity, m.min_threshold)}</td>
+            <td><strong>${m.name}</strong></td>
+            <td><span class="badge bg-secondary">${m.category}</span></td>
+            <td>
+                <span class="badge bg-info">Минимум: ${m.min_threshold} бр</span>
+            </td>
+            <td>
+                <button class="btn btn-sm btn-success" onclick="adjustMaterialQuantity(${m.id}, 10)">
+                    <i class="bi bi-plus-circle"></i> Добави 10
+                </button>
+                <button class="btn btn-sm btn-primary" onclick="showEditMaterialModal(${m.id})">
+                    <i class="bi bi-pencil"></i>
+                </button>
+            </td>
+        </tr>
+        `;
     }
     
     // Different display for low stock section
     if (filterType === 'low') {
-        tbody.innerHTML = materials.map(m => `
-            <tr class="table-warning">
-                <td>${getMaterialStatusBadge(m.quantity, m.min_threshold)}</td>
-                <td><strong>${m.name}</strong></td>
-                <td><span class="badge bg-secondary">${m.category}</span></td>
-                <td>
-                    <div class="d-flex align-items-center">
-                        <button class="btn btn-sm btn-outline-danger me-2" 
-                                onclick="adjustMaterialQuantity(${m.id}, -1)"
-                                ${m.quantity <= 0 ? 'disabled' : ''}>
-                            <i class="bi bi-dash"></i>
-                        </button>
-                        <strong class="mx-2">${m.quantity}</strong>
-                        <button class="btn btn-sm btn-outline-success ms-2" 
-                                onclick="adjustMaterialQuantity(${m.id}, 1)">
-                            <i class="bi bi-plus"></i>
-                        </button>
-                    </div>
-                    <small class="text-muted d-block mt-1">Минимум: ${m.min_threshold}</small>
-                </td>
-                <td>
-                    <small class="text-danger">
-                        <i class="bi bi-exclamation-triangle"></i> 
-                        ${m.quantity === 0 ? 'Изчерпано!' : `Под минимума с ${m.min_threshold - m.quantity} бр`}
-                    </small>
-                </td>
-                <td>
-                    <button class="btn btn-sm btn-primary" onclick="showEditMaterialModal(${m.id})">
-                        <i class="bi bi-pencil"></i>
+        return `
+        <tr class="table-warning" data-material-id="${m.id}">
+            <td>${getMaterialStatusBadge(m.quantity, m.min_threshold)}</td>
+            <td><strong>${m.name}</strong></td>
+            <td><span class="badge bg-secondary">${m.category}</span></td>
+            <td>
+                <div class="d-flex align-items-center">
+                    <button class="btn btn-sm btn-outline-danger me-2" 
+                            onclick="adjustMaterialQuantity(${m.id}, -1)"
+                            ${m.quantity <= 0 ? 'disabled' : ''}>
+                        <i class="bi bi-dash"></i>
                     </button>
-                </td>
-            </tr>
-        `).join('');
-        return;
+                    <strong class="mx-2" data-material-qty="${m.id}">${m.quantity}</strong>
+                    <button class="btn btn-sm btn-outline-success ms-2" 
+                            onclick="adjustMaterialQuantity(${m.id}, 1)">
+                        <i class="bi bi-plus"></i>
+                    </button>
+                </div>
+                <small class="text-muted d-block mt-1">Минимум: ${m.min_threshold}</small>
+            </td>
+            <td>
+                <small class="text-danger">
+                    <i class="bi bi-exclamation-triangle"></i> 
+                    ${m.quantity === 0 ? 'Изчерпано!' : `Под минимума с ${m.min_threshold - m.quantity} бр`}
+                </small>
+            </td>
+            <td>
+                <button class="btn btn-sm btn-primary" onclick="showEditMaterialModal(${m.id})">
+                    <i class="bi bi-pencil"></i>
+                </button>
+            </td>
+        </tr>
+        `;
     }
     
     // Normal display for all materials
-    tbody.innerHTML = materials.map(m => `
-        <tr${m.quantity > 0 && m.quantity <= m.min_threshold ? ' class="table-warning"' : ''}>
+    return `
+        <tr data-material-id="${m.id}"${m.quantity > 0 && m.quantity <= m.min_threshold ? ' class="table-warning"' : ''}>
             <td>${getMaterialStatusBadge(m.quantity, m.min_threshold)}</td>
             <td><strong>${m.name}</strong></td>
             <td><span class="badge bg-secondary">${m.category}</span></td>
@@ -177,7 +186,7 @@ function displayMaterials(materials, filterType = 'all') {
                             ${m.quantity <= 0 ? 'disabled' : ''}>
                         <i class="bi bi-dash"></i>
                     </button>
-                    <strong class="mx-2">${m.quantity}</strong>
+                    <strong class="mx-2" data-material-qty="${m.id}">${m.quantity}</strong>
                     <button class="btn btn-sm btn-outline-success ms-2" 
                             onclick="adjustMaterialQuantity(${m.id}, 1)">
                         <i class="bi bi-plus"></i>
@@ -198,48 +207,75 @@ function displayMaterials(materials, filterType = 'all') {
                 </button>
             </td>
         </tr>
-    `).join('');
+    `;
 }
 
 // Load categories for filter dropdown
 async function loadMaterialsCategories() {
     try {
-        const response = await fetch('/api/categories');
-        if (response.ok) {
-            const categories = await response.json();
-            const select = document.getElementById('materials-category');
-            select.innerHTML = '<option value="">Всички категории</option>' +
-                categories.map(c => `<option value="${c}">${c}</option>`).join('');
+        let categories = takePreloaded('categories');
+        if (!categories) {
+            const response = await fetch('/api/categories');
+            if (!response.ok) return;
+            categories = await response.json();
         }
+        const select = document.getElementById('materials-category');
+        select.innerHTML = '<option value="">Всички категории</option>' +
+            categories.map(c => `<option value="${c}">${c}</option>`).join('');
     } catch (error) {
         console.error('Error loading categories:', error);
     }
 }
 
-// Adjust material quantity
-async function adjustMaterialQuantity(id, change) {
+// Adjust material quantity - rapid taps are summed per material and sent
+// together in one /api/materials/quantities call once the clicking stops
+const pendingMaterialChanges = new Map();
+const flushMaterialChanges = debounce(saveMaterialChanges, 400);
+
+// Which rows each materials table shows: tbody id -> [filterType, keeps(material)]
+const MATERIAL_TABLES = {
+    'materials-tbody': ['all', m => !document.getElementById('materials-low-stock')?.checked ||
+                                    (m.stock_status === 'out' || m.stock_status === 'low')],
+    'materials-low-tbody': ['low', m => m.stock_status === 'out' || m.stock_status === 'low'],
+    'materials-out-tbody': ['out', m => m.stock_status === 'out']
+};
+
+function adjustMaterialQuantity(id, change) {
+    // Show the new quantity right away; like the server, never go below 0,
+    // so the summed change matches what is displayed
+    const shown = document.querySelectorAll(`[data-material-qty="${id}"]`);
+    if (shown.length > 0) {
+        const current = parseInt(shown[0].textContent);
+        const quantity = Math.max(0, current + change);
+        change = quantity - current;
+        shown.forEach(qty => { qty.textContent = quantity; });
+    }
+    
+    pendingMaterialChanges.set(id, (pendingMaterialChanges.get(id) || 0) + change);
+    flushMaterialChanges();
+}
+
+async function saveMaterialChanges() {
+    const changes = [...pendingMaterialChanges].map(([id, change]) => ({ id, change }));
+    pendingMaterialChanges.clear();
+    if (changes.length === 0) return;
+    
     try {
-        const response = await fetch(`/api/materials/${id}/quantity`, {
+        const response = await fetch('/api/materials/quantities', {
             method: 'PATCH',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ change })
+            body: JSON.stringify({ changes })
         });
         
         if (response.ok) {
+            const result = await response.json();
+            result.materials.forEach(updateMaterialRows);
+            updateStatistics();
             showToast('Количеството е обновено');
-            
-            // Reload current section
-            if (currentSection === 'materials-all') {
-                loadMaterials('all');
-            } else if (currentSection === 'materials-low') {
-                loadMaterials('low');
-            } else if (currentSection === 'materials-out') {
-                loadMaterials('out');
-            } else {
-                loadMaterials('all');
-            }
+            return;
         } else if (response.status === 401) {
             window.location.href = '/login';
+            return;
         } else {
             const error = await response.json();
             showToast(error.error || 'Грешка при обновяване', 'error');
@@ -248,6 +284,37 @@ async function adjustMaterialQuantity(id, change) {
         console.error('Error:', error);
         showToast('Грешка при свързване със сървъра', 'error');
     }
+    
+    // The optimistic numbers may be wrong now - reload current section
+    if (currentSection === 'materials-all') {
+        loadMaterials('all');
+    } else if (currentSection === 'materials-low') {
+        loadMaterials('low');
+    } else if (currentSection === 'materials-out') {
+        loadMaterials('out');
+    } else {
+        loadMaterials('all');
+    }
+}
+
+// Redraw a material's rows from the server's copy, dropping them from
+// tables whose filter no longer matches
+function updateMaterialRows(material) {
+    // Taps made while the request was in flight are still pending - keep showing them
+    const pending = pendingMaterialChanges.get(material.id) || 0;
+    material = { ...material, quantity: Math.max(0, material.quantity + pending) };
+    document.querySelectorAll(`tr[data-material-id="${material.id}"]`).forEach(row => {
+        const tbody = row.parentElement;
+        const [filterType, keeps] = MATERIAL_TABLES[tbody.id] || ['all', () => true];
+        if (keeps(material)) {
+            row.outerHTML = materialRow(material, filterType);
+        } else {
+            row.remove();
+            if (!tbody.querySelector('tr[data-material-id]')) {
+                loadMaterials(filterType);  // shows the empty-table message
+            }
+        }
+    });
 }
 
 // Show Add Material Modal
@@ -495,6 +562,32 @@ async function exportMaterials(lowStockOnly = false) {
     }
 }
 
+// Export the reorder list as a purchase order (suggested quantities up to the maximum)
+async function exportPurchaseOrder() {
+    try {
+        const response = await fetch('/api/reorder/export');
+        if (response.ok) {
+            const blob = await response.blob();
+            const url = window.URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = `purchase_order_${new Date().toISOString().split('T')[0]}.xlsx`;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+            window.URL.revokeObjectURL(url);
+            showToast('Файлът е изтеглен');
+        } else if (response.status === 401) {
+            window.location.href = '/login';
+        } else {
+            showToast('Грешка при експортиране', 'error');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        showToast('Грешка при свързване със сървъра', 'error');
+    }
+}
+
 // Add event listeners for search and filters
 document.addEventListener('DOMContentLoaded', function() {
     const searchInput = document.getElementById('materials-search');
@@ -34,13 +34,25 @@ async function loadRequests() {
     }
 }
 
-// Load filter options (users and materials)
+// Load filter options (users and materials) - both in one batch request
 async function loadFilterOptions() {
     try {
+        const response = await fetch('/api/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                requests: [
+                    { id: 'users', path: '/api/users' },
+                    { id: 'materials', path: '/api/materials?fields=id,name,category' }
+                ]
+            })
+        });
+        if (!response.ok) return;
+        const { responses } = await response.json();
+        
         // Load users
-        const usersResponse = await fetch('/api/users');
-        if (usersResponse.ok) {
-            const users = await usersResponse.json();
+        if (responses.users.status === 200) {
+            const users = responses.users.body;
             const userSelect = document.getElementById('filter-user');
             userSelect.innerHTML = '<option value="">Всички потребители</option>';
             users.forEach(user => {
@@ -49,9 +61,8 @@ async function loadFilterOptions() {
         }
         
         // Load materials
-        const materialsResponse = await fetch('/api/materials');
-        if (materialsResponse.ok) {
-            const materials = await materialsResponse.json();
+        if (responses.materials.status === 200) {
+            const materials = responses.materials.body;
             const materialSelect = document.getElementById('filter-material');
             materialSelect.innerHTML = '<option value="">Всички материали</option>';
             materials.forEach(material => {
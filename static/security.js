@@ -123,29 +123,48 @@ async function changePassword() {
     }
 }
 
+// Cursor for the next page of security logs (null when there are no more)
+let securityLogsCursor = null;
+
+// Build query string from the security log filters
+function getSecurityLogFilters() {
+    const params = new URLSearchParams();
+    const eventType = document.getElementById('logs-event-type')?.value || '';
+    const username = document.getElementById('logs-username')?.value.trim() || '';
+    const ip = document.getElementById('logs-ip')?.value.trim() || '';
+    const dateFrom = document.getElementById('logs-date-from')?.value || '';
+    const dateTo = document.getElementById('logs-date-to')?.value || '';
+    
+    if (eventType) params.set('event_type', eventType);
+    if (username) params.set('username', username);
+    if (ip) params.set('ip', ip);
+    if (dateFrom) params.set('date_from', dateFrom);
+    if (dateTo) params.set('date_to', dateTo);
+    
+    return params;
+}
+
 // Load security logs
-async function loadSecurityLogs() {
+async function loadSecurityLogs(append = false) {
     if (!currentUser || currentUser.role !== 'admin') {
         showToast('Нямате достъп до логовете', 'error');
         return;
     }
     
-    const limit = document.getElementById('logs-limit')?.value || 100;
-    const eventType = document.getElementById('logs-event-type')?.value || '';
-    const username = document.getElementById('logs-username')?.value || '';
+    const params = getSecurityLogFilters();
+    params.set('limit', document.getElementById('logs-limit')?.value || 100);
+    if (append && securityLogsCursor) params.set('cursor', securityLogsCursor);
     
     try {
-        let url = `/api/security-logs?limit=${limit}`;
-        if (eventType) url += `&event_type=${eventType}`;
-        if (username) url += `&username=${username}`;
-        
-        const response = await fetch(url, {
+        const response = await fetch(`/api/security-logs?${params}`, {
             credentials: 'same-origin'
         });
         
         if (response.ok) {
             const data = await response.json();
-            displaySecurityLogs(data.logs, data.total);
+            securityLogsCursor = data.next_cursor;
+            displaySecurityLogs(data.logs, data.total, append);
+            if (!append) loadSecurityRollups();
         } else if (response.status === 401) {
             window.location.href = '/login';
         } else if (response.status === 403) {
@@ -159,16 +178,59 @@ async function loadSecurityLogs() {
     }
 }
 
+// Load top IPs by failed attempts from the pre-aggregated rollups
+async function loadSecurityRollups() {
+    const tbody = document.getElementById('security-top-ips-tbody');
+    if (!tbody) return;
+    
+    try {
+        const response = await fetch('/api/security-logs/rollups?kind=ip&limit=5', {
+            credentials: 'same-origin'
+        });
+        if (!response.ok) return;
+        
+        const data = await response.json();
+        const rows = data.rows.filter(row => row.failed > 0);
+        
+        if (rows.length === 0) {
+            tbody.innerHTML = '<tr><td class="text-muted">Няма неуспешни опити</td></tr>';
+            return;
+        }
+        
+        tbody.innerHTML = rows.map(row => `
+            <tr>
+                <td><code class="small">${row.ip_address}</code></td>
+                <td class="text-end">
+                    <span class="badge bg-danger">${row.failed}</span>
+                    <small class="text-muted">от ${row.total}</small>
+                </td>
+            </tr>
+        `).join('');
+    } catch (error) {
+        console.error('Error loading security rollups:', error);
+    }
+}
+
+// Load the next page of security logs
+function loadMoreSecurityLogs() {
+    loadSecurityLogs(true);
+}
+
 // Display security logs
-function displaySecurityLogs(logs, total) {
+function displaySecurityLogs(logs, total, append = false) {
     const tbody = document.getElementById('security-logs-tbody');
+    const loadMore = document.getElementById('logs-load-more');
+    if (loadMore) loadMore.style.display = securityLogsCursor ? '' : 'none';
     
-    if (logs.length === 0) {
+    // Update stats
+    document.getElementById('total-logs').textContent = total;
+    
+    if (logs.length === 0 && !append) {
         tbody.innerHTML = '<tr><td colspan="7" class="text-center text-muted">Няма логове за показване</td></tr>';
         return;
     }
     
-    tbody.innerHTML = logs.map(log => {
+    const rows = logs.map(log => {
         const eventBadge = getEventBadge(log.event_type, log.success);
         const successIcon = log.success ? 
             '<i class="bi bi-check-circle-fill text-success"></i>' : 
@@ -192,8 +254,11 @@ function displaySecurityLogs(logs, total) {
         `;
     }).join('');
     
-    // Update stats
-    document.getElementById('total-logs').textContent = total;
+    if (append) {
+        tbody.insertAdjacentHTML('beforeend', rows);
+    } else {
+        tbody.innerHTML = rows;
+    }
 }
 
 // Get event type badge
@@ -214,78 +279,98 @@ function getEventBadge(eventType, success) {
 // Show log details
 async function showLogDetails(logId) {
     try {
-        const response = await fetch(`/api/security-logs?limit=1000`, {
+        const params = getSecurityLogFilters();
+        params.set('neighbours', 'true');
+        const response = await fetch(`/api/security-logs/${logId}?${params}`, {
             credentials: 'same-origin'
         });
         
         if (response.ok) {
-            const data = await response.json();
-            const log = data.logs.find(l => l.id === logId);
+            const log = await response.json();
+            const newer = log.neighbours.newer;
+            const older = log.neighbours.older;
             
-            if (log) {
-                const modal = `
-                    <div class="modal fade" id="logDetailsModal" tabindex="-1">
-                        <div class="modal-dialog modal-lg">
-                            <div class="modal-content">
-                                <div class="modal-header">
-                                    <h5 class="modal-title">
-                                        <i class="bi bi-file-text"></i> Детайли на лог #${log.id}
-                                    </h5>
-                                    <button type="button" class="btn-close" data-bs-dismiss="modal"></button>
-                                </div>
-                                <div class="modal-body">
-                                    <table class="table table-striped">
-                                        <tr>
-                                            <th style="width: 200px">ID:</th>
-                                            <td>${log.id}</td>
-                                        </tr>
-                                        <tr>
-                                            <th>Време:</th>
-                                            <td>${new Date(log.created_at).toLocaleString('bg-BG', {
-                                                year: 'numeric', month: 'long', day: 'numeric',
-                                                hour: '2-digit', minute: '2-digit', second: '2-digit'
-                                            })}</td>
-                                        </tr>
-                                        <tr>
-                                            <th>Тип събитие:</th>
-                                            <td>${getEventBadge(log.event_type, log.success)}</td>
-                                        </tr>
-                                        <tr>
-                                            <th>Потребител:</th>
-                                            <td><strong>${log.username}</strong></td>
-                                        </tr>
-                                        <tr>
-                                            <th>IP адрес:</th>
-                                            <td><code>${log.ip_address}</code></td>
-                                        </tr>
-                                        <tr>
-                                            <th>Успешно:</th>
-                                            <td>${log.success ? 
-                                                '<span class="badge bg-success">Да</span>' : 
-                                                '<span class="badge bg-danger">Не</span>'}</td>
-                                        </tr>
-                                        <tr>
-                                            <th>Детайли:</th>
-                                            <td>${log.details || '-'}</td>
-                                        </tr>
-                                        <tr>
-                                            <th>User Agent:</th>
-                                            <td><small class="font-monospace">${log.user_agent || '-'}</small></td>
-                                        </tr>
-                                    </table>
-                                </div>
-                                <div class="modal-footer">
-                                    <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">Затвори</button>
-                                </div>
-                            </div>
-                        </div>
-                    </div>
-                `;
-                
-                document.getElementById('modals-container').innerHTML = modal;
-                const modalEl = new bootstrap.Modal(document.getElementById('logDetailsModal'));
-                modalEl.show();
+            const content = `
+                <div class="modal-header">
+                    <h5 class="modal-title">
+                        <i class="bi bi-file-text"></i> Детайли на лог #${log.id}
+                    </h5>
+                    <button type="button" class="btn-close" data-bs-dismiss="modal"></button>
+                </div>
+                <div class="modal-body">
+                    <table class="table table-striped">
+                        <tr>
+                            <th style="width: 200px">ID:</th>
+                            <td>${log.id}</td>
+                        </tr>
+                        <tr>
+                            <th>Време:</th>
+                            <td>${new Date(log.created_at).toLocaleString('bg-BG', {
+                                year: 'numeric', month: 'long', day: 'numeric',
+                                hour: '2-digit', minute: '2-digit', second: '2-digit'
+                            })}</td>
+                        </tr>
+                        <tr>
+                            <th>Тип събитие:</th>
+                            <td>${getEventBadge(log.event_type, log.success)}</td>
+                        </tr>
+                        <tr>
+                            <th>Потребител:</th>
+                            <td><strong>${log.username}</strong></td>
+                        </tr>
+                        <tr>
+                            <th>IP адрес:</th>
+                            <td><code>${log.ip_address}</code></td>
+                        </tr>
+                        <tr>
+                            <th>Успешно:</th>
+                            <td>${log.success ? 
+                                '<span class="badge bg-success">Да</span>' : 
+                                '<span class="badge bg-danger">Не</span>'}</td>
+                        </tr>
+                        <tr>
+                            <th>Детайли:</th>
+                            <td>${log.details || '-'}</td>
+                        </tr>
+                        <tr>
+                            <th>User Agent:</th>
+                            <td><small class="font-monospace">${log.user_agent || '-'}</small></td>
+                        </tr>
+                    </table>
+                </div>
+                <div class="modal-footer">
+                    <button type="button" class="btn btn-outline-primary me-auto" 
+                            onclick="showLogDetails(${newer})" ${newer ? '' : 'disabled'}>
+                        <i class="bi bi-chevron-left"></i> По-нов
+                    </button>
+                    <button type="button" class="btn btn-outline-primary" 
+                            onclick="showLogDetails(${older})" ${older ? '' : 'disabled'}>
+                        По-стар <i class="bi bi-chevron-right"></i>
+                    </button>
+                    <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">Затвори</button>
+                </div>
+            `;
+            
+            // Navigating between logs reuses the open modal
+            const existing = document.getElementById('logDetailsModal');
+            if (existing && existing.classList.contains('show')) {
+                existing.querySelector('.modal-content').innerHTML = content;
+                return;
             }
+            
+            const modal = `
+                <div class="modal fade" id="logDetailsModal" tabindex="-1">
+                    <div class="modal-dialog modal-lg">
+                        <div class="modal-content">${content}</div>
+                    </div>
+                </div>
+            `;
+            
+            document.getElementById('modals-container').innerHTML = modal;
+            const modalEl = new bootstrap.Modal(document.getElementById('logDetailsModal'));
+            modalEl.show();
+        } else if (response.status === 404) {
+            showToast('Логът не е намерен', 'error');
         }
     } catch (error) {
         console.error('Error:', error);
@@ -293,48 +378,10 @@ async function showLogDetails(logId) {
     }
 }
 
-// Export security logs to CSV
-async function exportSecurityLogs() {
-    try {
-        const response = await fetch('/api/security-logs?limit=10000', {
-            credentials: 'same-origin'
-        });
-        
-        if (response.ok) {
-            const data = await response.json();
-            const logs = data.logs;
-            
-            // Create CSV content
-            const headers = ['ID', 'Дата и час', 'Тип', 'Потребител', 'IP адрес', 'Успешно', 'Детайли', 'User Agent'];
-            const rows = logs.map(log => [
-                log.id,
-                new Date(log.created_at).toLocaleString('bg-BG'),
-                log.event_type,
-                log.username,
-                log.ip_address,
-                log.success ? 'Да' : 'Не',
-                log.details || '',
-                log.user_agent || ''
-            ]);
-            
-            const csv = [
-                headers.join(','),
-                ...rows.map(row => row.map(cell => `"${cell}"`).join(','))
-            ].join('\n');
-            
-            // Download CSV
-            const blob = new Blob(['\ufeff' + csv], { type: 'text/csv;charset=utf-8;' });
-            const link = document.createElement('a');
-            link.href = URL.createObjectURL(blob);
-            link.download = `security_logs_${new Date().toISOString().split('T')[0]}.csv`;
-            link.click();
-            
-            showToast('Логовете са експортирани успешно', 'success');
-        } else {
-            showToast('Грешка при експорт', 'error');
-        }
-    } catch (error) {
-        console.error('Error:', error);
-        showToast('Грешка при експорт', 'error');
-    }
+// Export security logs to CSV (streamed by the server, with the current filters)
+function exportSecurityLogs() {
+    const params = getSecurityLogFilters();
+    params.set('format', 'csv');
+    window.location.href = `/api/security-logs/export?${params}`;
+    showToast('Изтегляне на файла...', 'success');
 }
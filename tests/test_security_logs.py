@@ -0,0 +1,48 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def fenix(tmp_path, monkeypatch):
+    # The databases and logs live next to the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'logs').mkdir()
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    with module.app.app_context():
+        module.init_db()
+    yield module
+    module.security_log_sink.stop()
+    module.db_writer.stop()
+    sys.modules.pop('app', None)
+
+
+def login(client):
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'Fenix@Admin2025!'})
+    assert response.status_code == 200
+
+
+def test_date_to_only_includes_archived_logs(fenix):
+    def seed(conn):
+        conn.execute("INSERT OR IGNORE INTO log_ips (ip_address) VALUES ('10.0.0.1')")
+        for day in range(1, 26):
+            for created_at in (f'2025-05-{day:02d} 10:00:00', f'2025-06-{day:02d} 10:00:00'):
+                conn.execute('''
+                    INSERT INTO security_logs (event_type, username, ip_id, success, details, created_at)
+                    VALUES ('LOGIN_FAILED', 'old', (SELECT id FROM log_ips WHERE ip_address = '10.0.0.1'), 0, '', ?)
+                ''', (created_at,))
+    fenix.run_write(seed)
+    assert fenix.archive_security_logs() == 50
+
+    client = fenix.app.test_client()
+    login(client)
+    fenix.security_log_sink.stop()  # flush the login event into the table
+
+    assert client.get('/api/security-logs?date_to=2025-06-30').json['total'] == 50
+    assert client.get('/api/security-logs?date_to=2025-05-31').json['total'] == 25
+    assert client.get('/api/security-logs?username=old').json['total'] == 0  # no range - hot table only